@@ -0,0 +1,181 @@
+"""
+    Inference backends for the bodypix models.
+
+    All backends take the preprocessed float32 image with the shape
+    (1, height, width, 3) and return the requested outputs ("segments",
+    "part_heatmaps" and/or "heatmaps") as NumPy arrays with the shape
+    (1, height, width, channels). Backends, whose model accepts several
+    images at once, have the attribute batched set, see run_batch().
+
+    - tensorflow: The (cached) TensorFlow graph, see models.py.
+    - tflite: A TensorFlow Lite model created by convert_model.py, which
+      uses the XNNPACK delegate on the CPU.
+    - onnx: An ONNX model created by convert_model.py, which is run with
+      ONNX Runtime.
+"""
+
+import os
+
+import tensorflow as tf
+import tfjs_graph_converter.util as tfjs_util
+
+import models
+
+
+OUTPUT_NAMES = ["segments", "part_heatmaps", "heatmaps"]
+
+
+def get_converted_model_filename(model_path, backend, quantized=False):
+    extension = {"tflite": ".tflite", "onnx": ".onnx"}[backend]
+    name = "model_int8" if quantized else "model"
+    return os.path.join(model_path, name + extension)
+
+
+def output_name(tensor_name):
+    """
+        Return the short output name for a tensor name like
+        "float_segments:0" or None for other tensors.
+    """
+    name = tensor_name.split(":")[0]
+    for output in OUTPUT_NAMES:
+        if name == "float_" + output or name.endswith("/float_" + output):
+            return output
+    return None
+
+
+class TensorflowBackend:
+    def __init__(self, model_path, threads=0, use_cache=True, batch=False):
+        graph = models.load_graph(model_path, use_cache)
+
+        input_tensor_names = tfjs_util.get_input_tensors(graph)
+        if batch:
+            # The bodypix models are fully convolutional, so only the
+            # input fixes the batch size
+            graph, self.input_tensor = models.with_batch_input(
+                graph, input_tensor_names[0])
+        else:
+            self.input_tensor = graph.get_tensor_by_name(
+                input_tensor_names[0])
+        self.batched = self.input_tensor.shape[0] is None
+
+        session_config = tf.compat.v1.ConfigProto(
+            intra_op_parallelism_threads=threads,
+            inter_op_parallelism_threads=threads)
+        self.sess = tf.compat.v1.Session(graph=graph, config=session_config)
+
+        self.tensor_names = {}
+        for tensor_name in tfjs_util.get_output_tensors(graph):
+            if output_name(tensor_name):
+                self.tensor_names[output_name(tensor_name)] = tensor_name
+        self.output_names = list(self.tensor_names)
+
+    def run(self, image, outputs):
+        fetch_names = [self.tensor_names[output] for output in outputs]
+        results = self.sess.run(fetch_names,
+                                feed_dict={self.input_tensor: image})
+        return dict(zip(outputs, results))
+
+
+class TFLiteBackend:
+    def __init__(self, model_filename, threads=0):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                Interpreter = tf.lite.Interpreter
+
+        # XNNPACK is the default delegate for float and int8 models
+        self.interpreter = Interpreter(model_path=model_filename,
+                                       num_threads=threads or None)
+        input_details = self.interpreter.get_input_details()[0]
+        self.input_index = input_details["index"]
+        self.batched = input_details["shape_signature"][0] == -1
+        self.output_indices = {}
+        for details in self.interpreter.get_output_details():
+            if output_name(details["name"]):
+                self.output_indices[output_name(details["name"])] = \
+                    details["index"]
+        self.output_names = list(self.output_indices)
+        self.input_shape = None
+
+    def run(self, image, outputs):
+        # The tensors must be reallocated, when the input shape changes
+        if image.shape != self.input_shape:
+            self.interpreter.resize_tensor_input(self.input_index,
+                                                 image.shape)
+            self.interpreter.allocate_tensors()
+            self.input_shape = image.shape
+        self.interpreter.set_tensor(self.input_index, image)
+        self.interpreter.invoke()
+        return {output: self.interpreter.get_tensor(
+                    self.output_indices[output])
+                for output in outputs}
+
+
+class OnnxBackend:
+    def __init__(self, model_filename, threads=0):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = \
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            model_filename, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # A fixed batch size is an int, a dynamic one a name or None
+        self.batched = not isinstance(model_input.shape[0], int)
+        self.tensor_names = {}
+        for output in self.session.get_outputs():
+            if output_name(output.name):
+                self.tensor_names[output_name(output.name)] = output.name
+        self.output_names = list(self.tensor_names)
+
+    def run(self, image, outputs):
+        results = self.session.run(
+            [self.tensor_names[output] for output in outputs],
+            {self.input_name: image})
+        return dict(zip(outputs, results))
+
+
+def run_batch(backend, images, outputs):
+    """
+        Run the model on a batch of preprocessed images with the shape
+        (batch, height, width, 3) and return the outputs for each image.
+        The model is run once for the batch, when the backend is batched,
+        and for each image otherwise.
+    """
+    if not backend.batched:
+        return [backend.run(images[i:i + 1], outputs)
+                for i in range(len(images))]
+    results = backend.run(images, outputs)
+    return [{output: result[i:i + 1] for output, result in results.items()}
+            for i in range(len(images))]
+
+
+def load_backend(config, model_path):
+    """
+        Create the inference backend selected in the config.
+    """
+    backend = config.get("backend", "tensorflow")
+    threads = config.get("inference_threads", 0)
+    if backend == "tensorflow":
+        return TensorflowBackend(model_path, threads,
+                                 config.get("model_cache", True),
+                                 config.get("batch_size", 1) > 1)
+    if backend not in ["tflite", "onnx"]:
+        raise ValueError('Unknown backend. '
+                         'Use "tensorflow", "tflite" or "onnx".')
+
+    model_filename = get_converted_model_filename(
+        model_path, backend, config.get("quantized", False))
+    if not os.path.exists(model_filename):
+        raise FileNotFoundError(
+            "{filename} not found. Create it with convert_model.py.".format(
+                filename=model_filename))
+    if backend == "tflite":
+        return TFLiteBackend(model_filename, threads)
+    return OnnxBackend(model_filename, threads)
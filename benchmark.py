@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+    Benchmark the virtual webcam without a webcam and without a virtual
+    video device.
+
+    Recorded frames (a video or image file) or synthetic frames are fed
+    through the same mainloop() as in virtual_webcam.py with the layers of
+    the given config and the output is discarded. Each combination of
+    resolution, model, stride and internal resolution runs in its own
+    process, so the peak memory usage can be measured per combination.
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import queue
+import resource
+import time
+
+import cv2
+import numpy as np
+import yaml
+
+
+STAGES = ["read_frame", "segment", "compose_frame", "write_frame"]
+
+
+class SyntheticCapture:
+    """
+        Replacement for cv2.VideoCapture. It loops over the frames of a
+        video or image file or over synthetic frames with a moving figure.
+    """
+
+    def __init__(self, width, height, path=None, num_frames=100):
+        self.width = width
+        self.height = height
+        self.frames = []
+        if path:
+            cap = cv2.VideoCapture(path)
+            while len(self.frames) < num_frames:
+                success, frame = cap.read()
+                if not success:
+                    break
+                self.frames.append(cv2.resize(frame, (width, height)))
+            cap.release()
+            if not self.frames:
+                raise ValueError("Cannot read frames from " + path)
+        else:
+            for i in range(num_frames):
+                self.frames.append(self.synthetic_frame(i / num_frames))
+        self.idx = 0
+
+    def synthetic_frame(self, t):
+        """
+            A noisy gradient background with a head and body shape, that
+            moves from left to right.
+        """
+        w, h = self.width, self.height
+        gradient = np.linspace(40, 200, w, dtype=np.uint8)
+        frame = np.empty((h, w, 3), dtype=np.uint8)
+        frame[:,:,0] = gradient
+        frame[:,:,1] = gradient[::-1]
+        frame[:,:,2] = 120
+        noise = np.random.randint(0, 20, (h, w, 3), dtype=np.uint8)
+        frame = cv2.add(frame, noise)
+
+        center_x = int(w * (0.3 + 0.4 * t))
+        cv2.ellipse(frame, (center_x, int(h * 0.35)),
+                    (int(w * 0.07), int(h * 0.13)), 0, 0, 360,
+                    (90, 120, 170), -1)
+        cv2.rectangle(frame, (center_x - int(w * 0.15), int(h * 0.5)),
+                      (center_x + int(w * 0.15), h), (60, 60, 140), -1)
+        return frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        return 0
+
+    def set(self, prop, value):
+        return False
+
+    def read(self):
+        frame = self.frames[self.idx % len(self.frames)]
+        self.idx += 1
+        return True, frame
+
+    def release(self):
+        pass
+
+
+class NullOutput:
+    """
+        Replacement for the virtual webcam, that discards the frames.
+    """
+
+    def schedule_frame(self, frame):
+        pass
+
+
+def timed(function, durations):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        durations.append(time.perf_counter() - start)
+        return result
+    return wrapper
+
+
+def percentiles(durations):
+    durations_ms = 1000.0 * np.array(durations)
+    return {
+        "p50": float(np.percentile(durations_ms, 50)),
+        "p90": float(np.percentile(durations_ms, 90)),
+        "p99": float(np.percentile(durations_ms, 99)),
+    }
+
+
+def run_case(config, options, results):
+    """
+        Run a single benchmark case. This runs in its own process.
+    """
+    try:
+        import virtual_webcam
+
+        virtual_webcam.config = config
+        capture = SyntheticCapture(config["width"], config["height"],
+                                   options.input)
+        virtual_webcam.setup(capture, NullOutput())
+
+        durations = {stage: [] for stage in STAGES}
+        for stage in STAGES:
+            setattr(virtual_webcam, stage,
+                    timed(getattr(virtual_webcam, stage), durations[stage]))
+
+        for i in range(options.warmup):
+            virtual_webcam.mainloop()
+        for stage in STAGES:
+            durations[stage].clear()
+        virtual_webcam.stats.stats.reset()
+
+        total = []
+        start = time.perf_counter()
+        for i in range(options.frames):
+            timed(virtual_webcam.mainloop, total)()
+        elapsed = time.perf_counter() - start
+
+        result = {
+            "fps": options.frames / elapsed,
+            "total": percentiles(total),
+            # ru_maxrss is given in kilobytes on Linux
+            "peak_rss_mb": resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        }
+        for stage in STAGES:
+            if durations[stage]:
+                result[stage] = percentiles(durations[stage])
+        # The detailed timings of the steps and filters
+        result["steps"] = virtual_webcam.stats.stats.summary()["timings"]
+        results.put(result)
+    except BaseException as e:
+        results.put({"error": repr(e)})
+
+
+def parse_models(models):
+    """
+        Parse model specifications like "mobilenet:0.5" or "resnet50".
+    """
+    parsed = []
+    for model in models.split(","):
+        name, _, multiplier = model.partition(":")
+        if multiplier:
+            parsed.append((name, float(multiplier)))
+        else:
+            parsed.append((name, 0.5))
+    return parsed
+
+
+def get_cases(options):
+    resolutions = [tuple(int(x) for x in resolution.split("x"))
+                   for resolution in options.resolutions.split(",")]
+    models = parse_models(options.models)
+    strides = [int(x) for x in options.strides.split(",")]
+    internal_resolutions = [float(x) for x in
+                            options.internal_resolutions.split(",")]
+    return itertools.product(resolutions, models, strides,
+                             internal_resolutions)
+
+
+def format_result(case_name, result):
+    if "error" in result:
+        return "{name}: failed: {error}".format(name=case_name,
+                                                error=result["error"])
+    stages = " ".join(
+        "{stage}={p50:.1f}/{p90:.1f}/{p99:.1f}".format(stage=stage,
+                                                       **result[stage])
+        for stage in STAGES + ["total"] if stage in result)
+    return "{name}: {fps:.1f} fps, peak RSS {rss:.0f} MB, " \
+           "p50/p90/p99 ms: {stages}".format(
+               name=case_name, fps=result["fps"],
+               rss=result["peak_rss_mb"], stages=stages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config.yaml",
+                        help="config file with the layers to benchmark")
+    parser.add_argument("--input",
+                        help="video or image file used as webcam image "
+                             "(default: synthetic frames)")
+    parser.add_argument("--frames", type=int, default=100,
+                        help="number of measured frames per case")
+    parser.add_argument("--warmup", type=int, default=10,
+                        help="number of frames before measuring")
+    parser.add_argument("--resolutions", default="640x480,1280x720",
+                        help="comma separated list of WIDTHxHEIGHT")
+    parser.add_argument("--models", default="mobilenet:0.5",
+                        help="comma separated list of models, e.g., "
+                             "mobilenet:0.5,mobilenet:0.75,resnet50")
+    parser.add_argument("--strides", default="16",
+                        help="comma separated list of output strides")
+    parser.add_argument("--internal-resolutions", default="0.5",
+                        help="comma separated list of internal resolutions")
+    parser.add_argument("--output",
+                        help="write the results to this YAML file")
+    options = parser.parse_args()
+
+    with open(options.config, "r") as configfile:
+        base_config = yaml.load(configfile, Loader=yaml.SafeLoader) or {}
+
+    context = multiprocessing.get_context("spawn")
+    all_results = []
+    for (width, height), (model, multiplier), stride, internal_resolution \
+            in get_cases(options):
+        config = dict(base_config)
+        config.update({
+            "width": width,
+            "height": height,
+            "model": model,
+            "multiplier": multiplier,
+            "stride": stride,
+            "internal_resolution": internal_resolution,
+        })
+        case_name = "{width}x{height} {model}".format(
+            width=width, height=height, model=model)
+        if model == "mobilenet":
+            case_name += " x{multiplier}".format(multiplier=multiplier)
+        case_name += " stride={stride} internal_resolution={res}".format(
+            stride=stride, res=internal_resolution)
+
+        results = context.Queue()
+        process = context.Process(target=run_case,
+                                  args=(config, options, results))
+        process.start()
+        result = None
+        while result is None:
+            try:
+                result = results.get(timeout=1.0)
+            except queue.Empty:
+                if not process.is_alive():
+                    result = {"error": "exit code {code}".format(
+                        code=process.exitcode)}
+        process.join()
+
+        print(format_result(case_name, result))
+        result["case"] = case_name
+        all_results.append(result)
+
+    if options.output:
+        with open(options.output, "w") as outputfile:
+            yaml.safe_dump(all_results, outputfile)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,119 @@
-import tensorflow as tf
+import cv2
 import numpy as np
 
-def remove_padding_and_resize_back(resized_and_padded, original_height, original_width,
+def logit(probability):
+    return np.log(probability / (1.0 - probability))
+
+def sigmoid(logits):
+    return 1.0 / (1.0 + np.exp(-logits))
+
+def tensor_scale(tensor_size, input_size, pad_before, pad_after):
+    """
+        Scale from input frame coordinates to tensor coordinates: the
+        corners of the padded frame are aligned with the corners of the
+        tensor.
+    """
+    return (tensor_size - 1) / max(1, input_size + pad_before + pad_after - 1)
+
+def scale_to_input_shape(image,
+        input_height, input_width,
         padT, padB, padL, padR):
-    return tf.squeeze(tf.image.crop_and_resize(resized_and_padded,
-        [[padT / (original_height + padT + padB - 1.0),
-        padL / (original_width + padL + padR - 1.0),
-        (padT + original_height - 1.0) / (original_height + padT + padB - 1.0),
-        (padL + original_width - 1.0) / (original_width + padL + padR - 1.0)]],
-        [0], [original_height, original_width]
-    ), [0])
-
-def scale_and_crop_to_input_tensor_shape(tensor,
-        input_tensor_height, input_tensor_width,
+    """
+        Crop the padding from an image with the model output resolution
+        (with up to 4 channels) and scale it to the input frame with a
+        single affine warp.
+    """
+    tensor_height, tensor_width = image.shape[:2]
+
+    # Map input frame coordinates to tensor coordinates
+    scale_y = tensor_scale(tensor_height, input_height, padT, padB)
+    scale_x = tensor_scale(tensor_width, input_width, padL, padR)
+    matrix = np.array([[scale_x, 0.0, padL * scale_x],
+                       [0.0, scale_y, padT * scale_y]])
+
+    return cv2.warpAffine(image, matrix, (input_width, input_height),
+                          flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+def scale_and_threshold_to_input_shape(tensor,
+        input_height, input_width,
         padT, padB, padL, padR,
-        apply_sigmoid_activation):
-    in_resized_and_padded = tf.image.resize_with_pad(tensor,
-        input_tensor_height, input_tensor_width,
-        method=tf.image.ResizeMethod.BILINEAR)
-    if apply_sigmoid_activation:
-        in_resized_and_padded = tf.sigmoid(in_resized_and_padded)
+        threshold, channels=None):
+    """
+        Threshold the model output and scale it to the input frame.
+
+        The threshold is applied to the logits at model resolution, i.e.,
+        sigmoid(x) > threshold is computed as x > logit(threshold), and the
+        resulting uint8 masks are cropped and upscaled with a single affine
+        warp. Return a dict with a boolean mask of the input frame size
+        for each of the channels (all channels, when channels is None), so
+        channels, that are not used, are not scaled.
+    """
+    tensor = np.asarray(tensor)
+    if tensor.ndim == 4:
+        tensor = tensor[0]
+    if channels is None:
+        channels = range(tensor.shape[2])
+
+    masks = {}
+    channels = list(channels)
+    # warpAffine handles at most 4 channels at once. It is as fast for
+    # 4 channels as for 1 channel, but slower for 2 or 3 channels,
+    # so these chunks are padded to 4 channels.
+    for i in range(0, len(channels), 4):
+        chunk = channels[i:i + 4]
+        num_warped = 4 if len(chunk) > 1 else 1
+        low_res = np.zeros(tensor.shape[:2] + (num_warped,), dtype=np.uint8)
+        low_res[:,:,:len(chunk)] = tensor[:,:,chunk] > logit(threshold)
+        scaled = scale_to_input_shape(low_res, input_height, input_width,
+                                      padT, padB, padL, padR)
+        for channel, scaled_channel in zip(chunk, cv2.split(scaled)):
+            # Upscaled 0/1 masks are rounded, i.e., thresholded at 0.5
+            masks[channel] = scaled_channel.view(np.bool_)
+    return masks
+
+def crop_to_frame_tensor(tensor, crop_box, crop_padding,
+        frame_tensor_height, frame_tensor_width,
+        input_height, input_width, padding, fill=-100.0):
+    """
+        Map the model output for a crop (top, bottom, left, right) of the
+        input frame to the model output for the whole input frame, so it
+        can be processed in the same way. Outside of the crop, the logits
+        are set to fill.
+    """
+    tensor = np.asarray(tensor)
+    if tensor.ndim == 4:
+        tensor = tensor[0]
+    tensor_height, tensor_width, num_channels = tensor.shape
+    top, bottom, left, right = crop_box
+    crop_padT, crop_padB, crop_padL, crop_padR = crop_padding
+    padT, padB, padL, padR = padding
 
-    return remove_padding_and_resize_back(in_resized_and_padded,
-        input_tensor_height, input_tensor_width, padT, padB, padL, padR)
+    crop_scale_y = tensor_scale(tensor_height, bottom - top,
+                                crop_padT, crop_padB)
+    crop_scale_x = tensor_scale(tensor_width, right - left,
+                                crop_padL, crop_padR)
+    scale_y = tensor_scale(frame_tensor_height, input_height, padT, padB)
+    scale_x = tensor_scale(frame_tensor_width, input_width, padL, padR)
+
+    # Frame tensor coordinates -> frame coordinates -> crop tensor coordinates
+    matrix = np.array([
+        [crop_scale_x / scale_x, 0.0, (crop_padL - left - padL) * crop_scale_x],
+        [0.0, crop_scale_y / scale_y, (crop_padT - top - padT) * crop_scale_y]])
+
+    result = np.empty((frame_tensor_height, frame_tensor_width, num_channels),
+                      dtype=np.float32)
+    # warpAffine handles at most 4 channels at once
+    for i in range(0, num_channels, 4):
+        chunk = np.ascontiguousarray(tensor[:,:,i:i + 4], dtype=np.float32)
+        warped = cv2.warpAffine(chunk, matrix,
+                                (frame_tensor_width, frame_tensor_height),
+                                flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                                borderMode=cv2.BORDER_CONSTANT,
+                                borderValue=(fill,) * 4)
+        result[:,:,i:i + 4] = warped.reshape(frame_tensor_height,
+                                             frame_tensor_width, -1)
+    return result[np.newaxis]
 
 def is_valid_input_resolution(resolution, output_stride):
     return (resolution - 1) % output_stride == 0;
@@ -36,8 +127,65 @@ def to_input_resolution_height_and_width(internal_resolution, output_stride, inp
     return (to_valid_input_resolution(input_height * internal_resolution, output_stride),
             to_valid_input_resolution(input_width * internal_resolution, output_stride))
 
-def to_mask_tensor(segment_scores, threshold):
-    return tf.math.greater(segment_scores, tf.constant(threshold))
+def normalize_input(image, model_type):
+    """
+        Normalize an RGB image with values between 0 and 255 for the
+        model type ("mobilenet" or "resnet50").
+    """
+    if model_type == "mobilenet":
+        return np.subtract(np.divide(image, 127.5, dtype=np.float32), 1.0,
+                           dtype=np.float32)
+    elif model_type == "resnet50":
+        return np.add(image, np.array([-123.15, -115.90, -103.06],
+                                      dtype=np.float32), dtype=np.float32)
+    raise ValueError("Unknown model type: " + str(model_type))
+
+class InputPreprocessor:
+    """
+        Resize with padding and normalization of frames with a fixed size
+        for a fixed model input size.
+
+        The padding geometry is computed once and the frames are resized
+        with OpenCV directly into the inner part of a preallocated float32
+        input tensor, whose padding is already normalized. The returned
+        tensor is reused for the next frame.
+    """
+
+    def __init__(self, input_height, input_width,
+                 target_height, target_width, model_type):
+        self.model_type = model_type
+        self.padding = calc_padding(np.empty((input_height, input_width)),
+                                    target_height, target_width)
+        padT, padB, padL, padR = self.padding
+
+        # Position of the frame in the model input
+        scale_y = target_height / (input_height + padT + padB)
+        scale_x = target_width / (input_width + padL + padR)
+        self.top = int(round(padT * scale_y))
+        self.left = int(round(padL * scale_x))
+        self.height = min(target_height - self.top,
+                          max(1, int(round(input_height * scale_y))))
+        self.width = min(target_width - self.left,
+                         max(1, int(round(input_width * scale_x))))
+
+        self.tensor = np.empty((1, target_height, target_width, 3),
+                               dtype=np.float32)
+        self.tensor[...] = normalize_input(np.zeros(3), model_type)
+        self.resized = np.empty((self.height, self.width, 3), dtype=np.uint8)
+
+    def __call__(self, frame):
+        cv2.resize(frame, (self.width, self.height), dst=self.resized,
+                   interpolation=cv2.INTER_LINEAR)
+        inner = self.tensor[0, self.top:self.top + self.height,
+                            self.left:self.left + self.width]
+        if self.model_type == "mobilenet":
+            np.multiply(self.resized, 1.0 / 127.5, out=inner,
+                        casting="unsafe")
+            np.subtract(inner, 1.0, out=inner)
+        else:
+            np.add(self.resized, normalize_input(np.zeros(3), self.model_type),
+                   out=inner, casting="unsafe")
+        return self.tensor
 
 def calc_padding(input_tensor, targetH, targetW):
     height, width = input_tensor.shape[:2]
@@ -0,0 +1,131 @@
+"""
+    Low latency capture from the webcam.
+
+    The frames are grabbed on a background thread, which keeps only the
+    newest frame, so a frame never waits in the buffers of the driver
+    while the previous one is processed. With capture_scale, frames are
+    delivered with a reduced size. MJPEG frames, that are returned
+    undecoded by OpenCV (CAP_PROP_CONVERT_RGB disabled), are then decoded
+    directly with the reduced size, which is much faster than decoding
+    and resizing the full frame.
+
+    Video files can be used instead of a device. They are played with
+    their frame rate.
+"""
+
+import threading
+import time
+
+import cv2
+
+
+# Decode flags for JPEG images with a reduced size
+REDUCED_DECODE_FLAGS = {
+    1.0: cv2.IMREAD_COLOR,
+    0.5: cv2.IMREAD_REDUCED_COLOR_2,
+    0.25: cv2.IMREAD_REDUCED_COLOR_4,
+    0.125: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def decode_frame(frame, scale=1.0):
+    """
+        Decode an undecoded MJPEG frame and scale the frame.
+    """
+    if frame.ndim == 1 or frame.shape[0] == 1:
+        frame = cv2.imdecode(frame.reshape(-1),
+                             REDUCED_DECODE_FLAGS.get(scale, cv2.IMREAD_COLOR))
+        if frame is None:
+            return None
+        if scale in REDUCED_DECODE_FLAGS:
+            return frame
+    if scale != 1.0:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale,
+                           interpolation=cv2.INTER_AREA)
+    return frame
+
+
+class Capture:
+    """
+        Grab frames from a cv2.VideoCapture on a background thread.
+        Capture has the read() and get() methods of cv2.VideoCapture, but
+        read() returns the newest frame and only waits, when this frame
+        was already returned. frame_time is the time.perf_counter() time,
+        when the last returned frame was grabbed.
+    """
+
+    def __init__(self, cap, scale=1.0):
+        self.cap = cap
+        self.scale = scale
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.dropped = 0
+
+        # Video files are played with their frame rate
+        self.frame_interval = 0.0
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if cap.get(cv2.CAP_PROP_FRAME_COUNT) > 0 and fps > 0:
+            self.frame_interval = 1.0 / fps
+
+        # The first frame determines the size of the frames
+        self.success, self.frame = self.grab()
+        self.grab_time = time.perf_counter()
+        self.frame_time = self.grab_time
+        self.frame_id = 1
+        self.read_id = 0
+
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name="capture")
+        self.thread.start()
+
+    def grab(self):
+        success, frame = self.cap.read()
+        if success:
+            frame = decode_frame(frame, self.scale)
+            success = frame is not None
+        return success, frame
+
+    def run(self):
+        next_time = time.perf_counter() + self.frame_interval
+        while not self.stopped and self.success:
+            success, frame = self.grab()
+            now = time.perf_counter()
+            with self.condition:
+                if self.read_id != self.frame_id:
+                    self.dropped += 1
+                self.success, self.frame = success, frame
+                self.grab_time = now
+                self.frame_id += 1
+                self.condition.notify_all()
+
+            if self.frame_interval:
+                time.sleep(max(0.0, next_time - time.perf_counter()))
+                next_time = max(next_time + self.frame_interval,
+                                time.perf_counter())
+
+    def read(self):
+        with self.condition:
+            while self.read_id == self.frame_id and self.success and \
+                    not self.stopped:
+                self.condition.wait()
+            self.read_id = self.frame_id
+            self.frame_time = self.grab_time
+            return self.success, self.frame
+
+    def get(self, prop):
+        if self.frame is not None:
+            if prop == cv2.CAP_PROP_FRAME_WIDTH:
+                return self.frame.shape[1]
+            if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+                return self.frame.shape[0]
+        return self.cap.get(prop)
+
+    def release(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join(timeout=1.0)
+        self.cap.release()
+
+    def stats(self):
+        return {"capture_dropped": self.dropped}
@@ -0,0 +1,128 @@
+"""
+    Compositing of the layer frames. Frames are uint8 RGB (the composed
+    frame) or RGBA (the layers) arrays.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+
+class BufferPool:
+    """
+        Reusable frame buffers keyed by shape and dtype.
+
+        acquire() returns a free buffer (with undefined content) or
+        allocates a new one and release() returns it to the pool. A buffer
+        must not be used after it was released. Buffers, that are never
+        released, are simply garbage collected.
+    """
+
+    def __init__(self):
+        self.free = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, shape, dtype=np.uint8):
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self.lock:
+            free_buffers = self.free.get(key)
+            if free_buffers:
+                return free_buffers.pop()
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, buffer):
+        # Views do not own their memory and cannot be reused safely
+        if buffer is None or buffer.base is not None:
+            return
+        key = (buffer.shape, buffer.dtype.str)
+        with self.lock:
+            self.free.setdefault(key, []).append(buffer)
+
+    def clear(self):
+        with self.lock:
+            self.free = {}
+
+
+def to_uint8(frame):
+    """
+        Convert a frame returned by a filter, that works on floats, back
+        to uint8.
+    """
+    if frame.dtype == np.uint8:
+        return frame
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def with_alpha(frame, alpha=255, out=None):
+    """
+        Return an RGBA copy of an RGB frame with the given alpha value or
+        alpha plane. The copy is written into out, when it is given.
+    """
+    rgba = out
+    if rgba is None:
+        rgba = np.empty(frame.shape[:2] + (4,), dtype=np.uint8)
+    # OpenCV copies the interleaved channels much faster than numpy slices
+    if frame.shape[2] == 3:
+        cv2.cvtColor(frame, cv2.COLOR_RGB2RGBA, dst=rgba)
+    else:
+        np.copyto(rgba, frame)
+    if isinstance(alpha, np.ndarray):
+        cv2.insertChannel(alpha, rgba, 3)
+    elif alpha != 255 or frame.shape[2] != 3:
+        rgba[:,:,3] = alpha
+    return rgba
+
+
+def alpha_range(layer_frame):
+    """
+        Return the minimum and maximum alpha value of a layer.
+        RGB layers are opaque.
+    """
+    if layer_frame.shape[2] == 3:
+        return 255, 255
+    min_value, max_value, _, _ = cv2.minMaxLoc(
+        cv2.extractChannel(layer_frame, 3))
+    return min_value, max_value
+
+
+def blend(frame, layer_frame, buffers=None):
+    """
+        Blend a layer over the RGB frame in place and return True, when
+        the layer is opaque, i.e., it replaced the frame.
+
+        RGBA layers are blended with premultiplied alpha. Layers without
+        transparent pixels are copied and fully transparent layers are
+        skipped. The scratch buffers are taken from the BufferPool
+        buffers, when it is given.
+    """
+    layer_frame = to_uint8(layer_frame)
+    if layer_frame.shape[2] == 3:
+        np.copyto(frame, layer_frame)
+        return True
+
+    if buffers is None:
+        buffers = BufferPool()
+    height, width = layer_frame.shape[:2]
+    alpha = buffers.acquire((height, width))
+    cv2.extractChannel(layer_frame, 3, dst=alpha)
+    min_alpha, max_alpha, _, _ = cv2.minMaxLoc(alpha)
+    if max_alpha == 0:
+        buffers.release(alpha)
+        return False
+    if min_alpha == 255:
+        cv2.cvtColor(layer_frame, cv2.COLOR_RGBA2RGB, dst=frame)
+        buffers.release(alpha)
+        return True
+
+    alpha3 = buffers.acquire((height, width, 3))
+    premultiplied = buffers.acquire((height, width, 3))
+    cv2.merge((alpha, alpha, alpha), dst=alpha3)
+    cv2.cvtColor(layer_frame, cv2.COLOR_RGBA2RGB, dst=premultiplied)
+    cv2.multiply(premultiplied, alpha3, dst=premultiplied, scale=1 / 255)
+    cv2.bitwise_not(alpha3, dst=alpha3)
+    cv2.multiply(frame, alpha3, dst=frame, scale=1 / 255)
+    cv2.add(frame, premultiplied, dst=frame)
+    for buffer in (alpha, alpha3, premultiplied):
+        buffers.release(buffer)
+    return False
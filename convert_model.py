@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+    Convert a bodypix model to TensorFlow Lite or ONNX for the "tflite"
+    and "onnx" backends, optionally with post-training int8 quantization.
+
+    The converted model is stored in the model folder as model.tflite /
+    model.onnx or model_int8.tflite / model_int8.onnx with --int8.
+    Quantization needs calibration images, which should look like typical
+    webcam images (a folder with images or a video). Without them,
+    synthetic frames are used, which gives worse results.
+"""
+
+import argparse
+import glob
+import os
+
+import cv2
+import tensorflow as tf
+
+import backends
+import models
+from bodypix_functions import InputPreprocessor
+from bodypix_functions import to_input_resolution_height_and_width
+
+
+def load_calibration_frames(path, width, height, num_frames):
+    """
+        Load RGB frames from an image folder, a video or (without path)
+        synthetic frames.
+    """
+    frames = []
+    if path and os.path.isdir(path):
+        for filename in sorted(glob.glob(os.path.join(path, "*.*"))):
+            image = cv2.imread(filename)
+            if image is not None:
+                frames.append(image)
+    elif path:
+        cap = cv2.VideoCapture(path)
+        while len(frames) < num_frames:
+            success, frame = cap.read()
+            if not success:
+                break
+            frames.append(frame)
+    else:
+        from benchmark import SyntheticCapture
+        print("No calibration images given, using synthetic frames.")
+        frames = SyntheticCapture(width, height,
+                                  num_frames=num_frames).frames
+
+    frames = [cv2.cvtColor(cv2.resize(frame, (width, height)),
+                           cv2.COLOR_BGR2RGB) for frame in frames]
+    return frames[:num_frames]
+
+
+def representative_inputs(options, model_type):
+    """
+        Yield preprocessed model inputs for the calibration. They are
+        preprocessed like the frames of the virtual webcam.
+    """
+    width, height = [int(x) for x in options.calibration_size.split("x")]
+    target_height, target_width = to_input_resolution_height_and_width(
+        options.internal_resolution, options.stride, height, width)
+    preprocessor = InputPreprocessor(height, width,
+                                     target_height, target_width, model_type)
+    for frame in load_calibration_frames(options.calibration_images,
+                                         width, height,
+                                         options.calibration_frames):
+        # The preprocessor reuses its tensor
+        yield preprocessor(frame).copy()
+
+
+def get_graph_io(graph):
+    """
+        Return the input tensor and the used output tensors of the graph.
+    """
+    input_tensor = None
+    output_tensors = []
+    for operation in graph.get_operations():
+        if operation.type == "Placeholder" and input_tensor is None:
+            input_tensor = operation.outputs[0]
+        for tensor in operation.outputs:
+            if backends.output_name(tensor.name) and \
+                    tensor not in output_tensors:
+                output_tensors.append(tensor)
+    return input_tensor, output_tensors
+
+
+def convert_tflite(graph, filename, options, model_type):
+    input_tensor, output_tensors = get_graph_io(graph)
+    if options.int8:
+        calibration_inputs = list(representative_inputs(options, model_type))
+    with tf.compat.v1.Session(graph=graph) as sess:
+        converter = tf.compat.v1.lite.TFLiteConverter.from_session(
+            sess, [input_tensor], output_tensors)
+        if options.int8:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.representative_dataset = lambda: (
+                [image] for image in calibration_inputs)
+        tflite_model = converter.convert()
+    with open(filename, "wb") as modelfile:
+        modelfile.write(tflite_model)
+
+
+class CalibrationDataReader:
+    def __init__(self, input_name, inputs):
+        self.input_name = input_name
+        self.inputs = iter(inputs)
+
+    def get_next(self):
+        image = next(self.inputs, None)
+        if image is None:
+            return None
+        return {self.input_name: image}
+
+    def rewind(self):
+        pass
+
+
+def convert_onnx(graph, filename, options, model_type):
+    import tf2onnx
+
+    input_tensor, output_tensors = get_graph_io(graph)
+    float_filename = filename
+    if options.int8:
+        float_filename = filename + ".float.tmp"
+    tf2onnx.convert.from_graph_def(
+        graph.as_graph_def(),
+        input_names=[input_tensor.name],
+        output_names=[tensor.name for tensor in output_tensors],
+        opset=options.opset, output_path=float_filename)
+
+    if options.int8:
+        from onnxruntime import quantization
+        reader = CalibrationDataReader(
+            input_tensor.name, representative_inputs(options, model_type))
+        quantization.quantize_static(
+            float_filename, filename, reader,
+            quant_format=quantization.QuantFormat.QDQ,
+            activation_type=quantization.QuantType.QUInt8,
+            weight_type=quantization.QuantType.QInt8)
+        os.remove(float_filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("format", choices=["tflite", "onnx"])
+    parser.add_argument("--model", default="mobilenet",
+                        choices=["mobilenet", "resnet50"])
+    parser.add_argument("--multiplier", type=float, default=0.5)
+    parser.add_argument("--stride", type=int, default=16)
+    parser.add_argument("--int8", action="store_true",
+                        help="quantize the weights and activations to int8")
+    parser.add_argument("--calibration-images",
+                        help="folder with images or a video for the "
+                             "int8 calibration")
+    parser.add_argument("--calibration-frames", type=int, default=100)
+    parser.add_argument("--calibration-size", default="1280x720",
+                        help="WIDTHxHEIGHT of the webcam images")
+    parser.add_argument("--internal-resolution", type=float, default=0.5)
+    parser.add_argument("--opset", type=int, default=13,
+                        help="ONNX opset version")
+    options = parser.parse_args()
+
+    model_path = models.get_model_path(options.model, options.multiplier,
+                                       options.stride)
+    graph = models.load_graph(model_path)
+    filename = backends.get_converted_model_filename(
+        model_path, options.format, options.int8)
+
+    print("Converting {path} to {filename}...".format(path=model_path,
+                                                      filename=filename))
+    if options.format == "tflite":
+        convert_tflite(graph, filename, options, options.model)
+    else:
+        convert_onnx(graph, filename, options, options.model)
+    print("done.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+    Watch a file for changes without a system call per frame.
+
+    On Linux, a background thread waits for inotify events of the directory
+    of the file, as editors often replace a file instead of writing it.
+    Where inotify is not available, changed() reports a possible change at
+    most every poll_interval seconds, so the caller only checks the mtime
+    of the file at this rate.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+import time
+
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def inotify_watch(path, mask):
+    """
+        Return an inotify file descriptor watching path
+        or None, when inotify is not available.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init()
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(path), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class FileWatcher:
+    def __init__(self, path, poll_interval=1.0):
+        self.path = os.path.abspath(path)
+        self.name = os.fsencode(os.path.basename(self.path))
+        self.poll_interval = poll_interval
+        self.last_poll = time.time()
+        self.event = threading.Event()
+
+        # Only report complete files, not each write
+        self.fd = inotify_watch(os.path.dirname(self.path),
+                                IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO)
+        if self.fd is not None:
+            self.thread = threading.Thread(target=self.run, daemon=True,
+                                           name="file watcher")
+            self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except OSError:
+                # Fall back to polling
+                self.fd = None
+                self.event.set()
+                return
+
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data,
+                                                                    offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if name == self.name:
+                    self.event.set()
+
+    def changed(self):
+        """
+            Return True, when the file may have changed since the last call.
+        """
+        if self.fd is not None:
+            if not self.event.is_set():
+                return False
+            self.event.clear()
+            return True
+
+        now = time.time()
+        if now - self.last_poll < self.poll_interval:
+            return False
+        self.last_poll = now
+        return True
@@ -1,5 +1,10 @@
+import time
+
 filters = {}
 
+# The config values, that are used by the constructors of the filters
+FILTER_CONFIG_KEYS = ["width", "height", "cache_dir"]
+
 
 def register_filter(name, filter):
     global filters
@@ -10,9 +15,45 @@ def get_filter(name):
     return filters.get(name, None)
 
 
-def get_filters(config, filter_list):
+def filter_spec(config, filters_item):
+    """
+        Return a key for a filter item of the config and the config values,
+        that are used by the filter constructors.
+    """
+    return repr((filters_item,
+                 [config.get(key) for key in FILTER_CONFIG_KEYS]))
+
+
+def filters_by_spec(image_filters):
+    """
+        Group filters created by get_filters by their spec, so they can be
+        reused with get_filters for the next config.
+    """
+    grouped = {}
+    for image_filter in image_filters:
+        spec = getattr(image_filter, "spec", None)
+        if spec is not None:
+            grouped.setdefault(spec, []).append(image_filter)
+    return grouped
+
+
+def get_filters(config, filter_list, previous_filters=None):
+    """
+        Create the filters for a list of filter items of the config.
+        previous_filters are the filters of the previous config grouped
+        by filters_by_spec. Filters with an unchanged spec are taken from
+        there instead of creating new ones, so e.g. videos keep playing.
+    """
+    if previous_filters is None:
+        previous_filters = {}
     image_filters = []
     for filters_item in filter_list:
+        spec = filter_spec(config, filters_item)
+        if previous_filters.get(spec):
+            image_filters.append(previous_filters[spec].pop(0))
+            continue
+
+        num_filters = len(image_filters)
         if type(filters_item) == str:
             filter_class = get_filter(filters_item)
             image_filters.append(filter_class())
@@ -38,18 +79,88 @@ def get_filters(config, filter_list):
 
             image_filters.append(image_filter_class(config=config,
                                                     *_args, **_kwargs))
+        if len(image_filters) > num_filters:
+            image_filters[-1].spec = spec
     return image_filters
 
 
-def apply_filters(frame, mask, part_masks, heatmap_masks, image_filters):
+def add_required_output(outputs, name, channels=None):
+    """
+        Add a model output ("part_heatmaps" or "heatmaps") to the dict of
+        required outputs. channels is the list of used channels or None,
+        when all channels are used.
+    """
+    if name in outputs and outputs[name] is None:
+        return outputs
+    if channels is None:
+        outputs[name] = None
+    else:
+        outputs[name] = sorted(set(outputs.get(name, [])) | set(channels))
+    return outputs
+
+
+def get_required_outputs(image_filters, outputs=None):
+    """
+        Collect the model outputs needed by the filters. Filters, that use
+        part_masks or heatmap_masks, declare this in their
+        required_outputs attribute, e.g., {"part_heatmaps": [0, 1]}.
+        part_masks and heatmap_masks are dicts with a boolean mask of the
+        frame size for each required channel, e.g., part_masks[0].
+    """
+    if outputs is None:
+        outputs = {}
     for image_filter in image_filters:
+        required_outputs = getattr(image_filter, "required_outputs", {})
+        for name, channels in required_outputs.items():
+            add_required_output(outputs, name, channels)
+    return outputs
+
+
+def is_static(image_filters):
+    """
+        Return True, when the filters produce the same output every frame
+        for an empty layer. Filters, whose output only depends on the
+        input frame and their parameters, set the attribute static = True.
+        Static filters with an external source (e.g. an image file)
+        implement changed() to report when the source was modified.
+    """
+    return all(getattr(image_filter, "static", False)
+               for image_filter in image_filters)
+
+
+def filters_changed(image_filters):
+    return any(image_filter.changed() for image_filter in image_filters
+               if hasattr(image_filter, "changed"))
+
+
+def apply_filters(frame, mask, part_masks, heatmap_masks, image_filters,
+                  buffers=None, stats=None, stats_name=""):
+    """
+        Apply the filters to the frame.
+
+        Filters own the frame they get while apply() runs: they may modify
+        it in place and return it (or a view of it) or return a new array.
+        They must not keep a reference to the frame, as the buffer is reused
+        for the next frame. Scratch buffers can be taken from the
+        BufferPool passed as buffers. When stats is given, the duration
+        of each filter is recorded as stats_name followed by the position
+        and class of the filter, e.g. "layer1:foreground/filter0:Blur".
+    """
+    for index, image_filter in enumerate(image_filters):
+        start = time.perf_counter()
         try:
             frame = image_filter.apply(frame=frame, mask=mask,
                                        part_masks=part_masks,
-                                       heatmap_masks=heatmap_masks)
+                                       heatmap_masks=heatmap_masks,
+                                       buffers=buffers)
         except TypeError:
             # caused by a wrong number of arguments in the config
             pass
+        if stats is not None:
+            name = "{prefix}filter{index}:{filter_type}".format(
+                prefix=stats_name, index=index,
+                filter_type=type(image_filter).__name__)
+            stats.record(name, time.perf_counter() - start)
     return frame
 
 
@@ -12,6 +12,11 @@ class Anonymize:
         self.secure = secure
         self.eyes_only = eyes_only
 
+        if self.eyes_only:
+            self.required_outputs = {"heatmaps": [1, 2]}
+        else:
+            self.required_outputs = {"part_heatmaps": [0, 1]}
+
     def apply(self, *args, **kwargs):
         frame = kwargs['frame']
         part_masks = kwargs['part_masks']
@@ -19,11 +24,11 @@ class Anonymize:
 
         if self.eyes_only:
             # left and right eye
-            face_mask = np.bitwise_or(heatmap_masks[:,:,1],
-                                      heatmap_masks[:,:,2])
+            face_mask = np.bitwise_or(heatmap_masks[1],
+                                      heatmap_masks[2])
         else:
             # left and right half of the face
-            face_mask = np.bitwise_or(part_masks[:,:,0], part_masks[:,:,1])
+            face_mask = np.bitwise_or(part_masks[0], part_masks[1])
 
         objs = ndimage.find_objects(face_mask)
         min_x, min_y, max_x, max_y = np.inf, np.inf, -np.inf, -np.inf
@@ -47,7 +52,7 @@ class Anonymize:
             anonymized_frame = cv2.blur(frame, (self.blur, self.blur))
         else:
             anonymized_frame = frame
-            anonymized_frame[:,:,:3] = 0.0
+            anonymized_frame[:,:,:3] = 0
         anonymized_frame[:,:,:4] = anonymized_frame[:,:,:4] * face_mask
 
         return anonymized_frame
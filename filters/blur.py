@@ -3,6 +3,8 @@ import filters
 
 
 class Blur:
+    static = True
+
     def __init__(self, intensity_x=5, intensity_y=-1, *args, **kwargs):
         self.intensity_x = intensity_x
         if intensity_y > 0:
@@ -0,0 +1,157 @@
+"""
+    On-disk cache for decoded and resized images and video frames.
+
+    The cache is only used, when cache_dir is set in the config. The
+    frames of a source are stored as one raw uint8 file, which is loaded
+    as a read-only memory mapped array. Cache entries are addressed by
+    hashes of the source path, of its mtime and size and of the
+    parameters used to produce the frames, so changed sources or
+    parameters never hit stale entries. When an entry is stored, the
+    entries of older versions of the same source are deleted.
+"""
+
+import glob
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+
+def get_cache_dir(config):
+    """
+        Return the cache directory from the config or None, when no
+        cache_dir is set.
+    """
+    cache_dir = config.get("cache_dir")
+    if not cache_dir:
+        return None
+    return os.path.expanduser(cache_dir)
+
+
+def short_hash(value):
+    return hashlib.sha1(repr(value).encode("utf-8")).hexdigest()[:16]
+
+
+def cache_key(path, **params):
+    """
+        Return the key "SOURCE-VERSION-PARAMS" for the frames of path
+        produced with params.
+    """
+    path_stat = os.stat(path)
+    return "-".join([short_hash(os.path.abspath(path)),
+                     short_hash((path_stat.st_mtime, path_stat.st_size)),
+                     short_hash(sorted(params.items()))])
+
+
+def remove_old_versions(cache_dir, key):
+    """
+        Delete the entries of the source of key, whose version differs
+        from the version in key.
+    """
+    source, version = key.split("-")[:2]
+    for filename in glob.glob(os.path.join(cache_dir, source + "-*.raw")):
+        if not os.path.basename(filename).startswith(
+                source + "-" + version + "-"):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+
+def load_frames(cache_dir, key):
+    """
+        Return the cached frames as memory mapped array with the shape
+        (frames, height, width, channels) or None.
+    """
+    if cache_dir is None:
+        return None
+    for filename in glob.glob(os.path.join(cache_dir, key + "_*.raw")):
+        try:
+            shape = os.path.basename(filename)[len(key) + 1:-4]
+            height, width, channels = [int(x) for x in shape.split("x")]
+            frame_size = height * width * channels
+            num_frames = os.stat(filename).st_size // frame_size
+            if num_frames == 0:
+                continue
+            return np.memmap(filename, dtype=np.uint8, mode="r",
+                             shape=(num_frames, height, width, channels))
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+class FrameWriter:
+    """
+        Append frames of the same shape to a cache entry. The entry is
+        only visible to load_frames() after close() was called, entries
+        of writers that are not closed are discarded.
+    """
+
+    def __init__(self, cache_dir, key):
+        self.cache_dir = cache_dir
+        self.key = key
+        self.file = None
+        self.shape = None
+        self.tmp_filename = None
+
+    def write(self, frame):
+        if self.shape is None:
+            self.shape = frame.shape
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # Each writer has its own file, as several filters may
+                # write the same entry at the same time
+                fd, self.tmp_filename = tempfile.mkstemp(
+                    prefix=self.key + ".", suffix=".tmp", dir=self.cache_dir)
+                self.file = os.fdopen(fd, "wb")
+            except OSError as e:
+                print("Cannot write to the cache:", e)
+        if self.file is None:
+            return
+        if frame.shape != self.shape:
+            self.abort()
+            return
+        self.file.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        height, width, channels = self.shape
+        filename = os.path.join(self.cache_dir,
+            "{key}_{height}x{width}x{channels}.raw".format(
+                key=self.key, height=height, width=width, channels=channels))
+        try:
+            os.replace(self.tmp_filename, filename)
+        except OSError as e:
+            print("Cannot write to the cache:", e)
+            self.remove_tmp_file()
+            return
+        remove_old_versions(self.cache_dir, self.key)
+
+    def abort(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        self.remove_tmp_file()
+
+    def remove_tmp_file(self):
+        try:
+            os.remove(self.tmp_filename)
+        except OSError:
+            pass
+
+    def __del__(self):
+        self.abort()
+
+
+def store_frames(cache_dir, key, frames):
+    if cache_dir is None:
+        return
+    writer = FrameWriter(cache_dir, key)
+    for frame in frames:
+        writer.write(frame)
+    writer.close()
@@ -4,9 +4,11 @@ import numpy as np
 
 
 class SolidColor:
+    static = True
+
     def __init__(self, r=0.0, g=0.0, b=0.0, *args, **kwargs):
-        self.rgb = np.array([r, g, b])
-        self.rgba = np.array([r, g, b, 255.0])
+        self.rgb = np.array([r, g, b], dtype=np.uint8)
+        self.rgba = np.array([r, g, b, 255], dtype=np.uint8)
 
     def apply(self, *args, **kwargs):
         frame = kwargs['frame']
@@ -18,30 +20,36 @@ class SolidColor:
 
 
 class Colorize:
+    static = True
+
     def __init__(self, r=255.0, g=255.0, b=255.0, *args, **kwargs):
         self.color_filter = ColorFilter(r, g, b)
 
     def apply(self, *args, **kwargs):
-        frame = kwargs['frame'].astype(np.uint8)
+        frame = kwargs['frame']
         gray_frame = cv2.cvtColor(frame[:,:,:3], cv2.COLOR_BGR2GRAY)
         gray_frame = cv2.cvtColor(gray_frame, cv2.COLOR_GRAY2BGR)
         frame[:,:,:3] = gray_frame
-        kwargs['frame'] = frame.astype(np.float)
+        kwargs['frame'] = frame
         return self.color_filter.apply(*args, **kwargs)
 
 
 class ColorFilter:
+    static = True
+
     def __init__(self, r=255.0, g=255.0, b=255.0, *args, **kwargs):
         self.r = r
         self.g = g
         self.b = b
 
+        # Lookup table with the scaled values for each channel
+        values = np.arange(256).reshape(256, 1)
+        lut = values * np.array([r, g, b]) / 255.0
+        self.lut = np.clip(lut, 0, 255).astype(np.uint8).reshape(1, 256, 3)
+
     def apply(self, *args, **kwargs):
         frame = kwargs['frame']
-        frame[:,:,0] = frame[:,:,0] * self.r / 255.0
-        frame[:,:,1] = frame[:,:,1] * self.g / 255.0
-        frame[:,:,2] = frame[:,:,2] * self.b / 255.0
-        frame = np.clip(frame, 0.0, 255.0)
+        frame[:,:,:3] = cv2.LUT(frame[:,:,:3], self.lut)
         return frame
 
 
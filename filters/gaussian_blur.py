@@ -3,6 +3,8 @@ import filters
 
 
 class GaussianBlur:
+    static = True
+
     def __init__(self, intensity_x=5, intensity_y=-1, *args, **kwargs):
         if intensity_y < 0:
             intensity_y = intensity_x
@@ -1,17 +1,18 @@
 import cv2
-import numpy as np
 import filters
 
 
 class Grayscale:
+    static = True
+
     def __init__(self, *args, **kwargs):
         pass
 
     def apply(self, *args, **kwargs):
-        frame = kwargs['frame'].astype(np.uint8)
+        frame = kwargs['frame']
         gray_frame = cv2.cvtColor(frame[:,:,:3], cv2.COLOR_BGR2GRAY)
         gray_frame = cv2.cvtColor(gray_frame, cv2.COLOR_GRAY2BGR)
-        frame[:,:,:3] = gray_frame.astype(np.float)
+        frame[:,:,:3] = gray_frame
         return frame
 
 
@@ -4,9 +4,28 @@ import os
 import stat
 import glob
 import time
+from filters import cache
 
 
-def reload_images(images_path, mtime, width, height, interpolation_method):
+def load_image(filename, width, height, interpolation_method):
+    image_raw = cv2.imread(filename, cv2.IMREAD_UNCHANGED)
+
+    _interpolation_method = cv2.INTER_LINEAR
+    if interpolation_method == "NEAREST":
+        _interpolation_method = cv2.INTER_NEAREST
+
+    image = cv2.resize(image_raw, (width, height),
+                       interpolation=_interpolation_method)
+    if len(image.shape) == 2:  # grayscale image
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+    # BGR to RGB
+    image[:,:,0], image[:,:,2] = image[:,:,2], image[:,:,0].copy()
+    return image
+
+
+def reload_images(images_path, mtime, width, height, interpolation_method,
+                  cache_dir=None):
     # Do nothing, if the image is unchanged
     images_stat = os.stat(images_path)
     if images_stat.st_mtime == mtime:
@@ -20,25 +39,37 @@ def reload_images(images_path, mtime, width, height, interpolation_method):
 
     images = []
     for filename in filenames:
-        image_raw = cv2.imread(filename, cv2.IMREAD_UNCHANGED)
-
-        _interpolation_method = cv2.INTER_LINEAR
-        if interpolation_method == "NEAREST":
-            _interpolation_method = cv2.INTER_NEAREST
-
-        image = cv2.resize(image_raw, (width, height),
-                           interpolation=_interpolation_method)
-        if len(image.shape) == 2:  # grayscale image
-            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
-
-        # BGR to RGB
-        image[:,:,0], image[:,:,2] = image[:,:,2], image[:,:,0].copy()
+        # Use the decoded and resized image from the cache, if possible
+        key = cache.cache_key(filename, width=width, height=height,
+                              interpolation_method=interpolation_method)
+        cached = cache.load_frames(cache_dir, key)
+        if cached is not None:
+            images.append(cached[0])
+            continue
+
+        image = load_image(filename, width, height, interpolation_method)
+        cache.store_frames(cache_dir, key, [image])
         images.append(image)
 
     return images, mtime_new
 
 
+def copy_to_frame(image, frame):
+    """
+        Copy the image into the frame buffer and return the frame or
+        (for RGB images) its RGB view, so the layer stays opaque.
+    """
+    if frame.shape[:2] != image.shape[:2] or \
+            frame.shape[2] < image.shape[2]:
+        return image.copy()
+    channels = image.shape[2]
+    frame[:,:,:channels] = image
+    return frame[:,:,:channels]
+
+
 class Image:
+    static = True
+
     def __init__(self, image_path, interpolation_method="LINEAR",
                  *args, **kwargs):
         config = kwargs['config']
@@ -49,20 +80,33 @@ class Image:
         self.image_path = image_path
         self.interpolation_method = interpolation_method
         self.mtime = 0
+        self.last_check_time = time.time()
+        self.cache_dir = cache.get_cache_dir(config)
 
         self.reload_image()
 
     def reload_image(self):
         images, new_mtime = reload_images(self.image_path, self.mtime,
-                self.width, self.height, self.interpolation_method)
+                self.width, self.height, self.interpolation_method,
+                self.cache_dir)
 
         if images:
             self.image = images[0]
             self.mtime = new_mtime
 
+    def changed(self):
+        # Check the file at most once per second
+        if time.time() - self.last_check_time < 1.0:
+            return False
+        self.last_check_time = time.time()
+        try:
+            return os.stat(self.image_path).st_mtime != self.mtime
+        except OSError:
+            return False
+
     def apply(self, *args, **kwargs):
         self.reload_image()
-        return self.image.copy()
+        return copy_to_frame(self.image, kwargs['frame'])
 
 
 class ImageSequence:
@@ -77,12 +121,14 @@ class ImageSequence:
         self.fps = fps
         self.interpolation_method = interpolation_method
         self.mtime = 0
+        self.cache_dir = cache.get_cache_dir(config)
 
         self.reload_images()
 
     def reload_images(self):
         images, new_mtime = reload_images(self.images_path, self.mtime,
-                self.width, self.height, self.interpolation_method)
+                self.width, self.height, self.interpolation_method,
+                self.cache_dir)
 
         if images:
             self.images = images
@@ -92,7 +138,7 @@ class ImageSequence:
 
     def apply(self, *args, **kwargs):
         self.reload_images()
-        frame = self.images[self.idx].copy()
+        frame = copy_to_frame(self.images[self.idx], kwargs['frame'])
         if time.time() - self.last_frame_time > 1.0 / self.fps:
             self.idx = (self.idx + 1) % len(self.images)
             self.last_frame_time = time.time()
@@ -12,12 +12,14 @@ class Stripes:
     def apply(self, *args, **kwargs):
         self.roll_y = (self.roll_y + self.speed) % (self.width * 2)
         frame = kwargs['frame']
+        # Brightness offset for each row
+        offsets = np.zeros(frame.shape[0], dtype=np.int16)
         for i in range(self.width):
-            frame[i + self.roll_y + 0::2 * self.width,:,:3] -= \
+            offsets[i + self.roll_y + 0::2 * self.width] = -self.intensity
+            offsets[i + self.roll_y + self.width::2 * self.width] = \
                 self.intensity
-            frame[i + self.roll_y + self.width::2 * self.width,:,:3] += \
-                self.intensity
-        return np.clip(frame, 0.0, 255.0)
+        frame[:,:,:3] = np.clip(frame[:,:,:3] + offsets[:,None,None], 0, 255)
+        return frame
 
 
 filters.register_filter("stripes", Stripes)
@@ -5,6 +5,8 @@ from scipy import ndimage
 
 
 class Flip:
+    static = True
+
     def __init__(self, horizontal=True, vertical=False, *args, **kwargs):
         self.horizontal = horizontal
         self.vertical = vertical
@@ -18,6 +20,8 @@ class Flip:
         return frame
 
 class Zoom:
+    static = True
+
     def __init__(self, horizontal, vertical=None, pad_and_crop=True,
                  *args, **kwargs):
         self.horizontal = horizontal
@@ -34,13 +38,13 @@ class Zoom:
 
         if zoomed.shape[2] == 3:
             # Add alpha channel
-            zoomed = np.append(zoomed,
-                    np.ones((zoomed.shape[0], zoomed.shape[1], 1)) * 255.0,
-                    axis=2)
+            zoomed = np.dstack((zoomed,
+                np.full(zoomed.shape[:2], 255, dtype=np.uint8)))
 
 
         if self.pad_and_crop:
-            frame = np.zeros((frame.shape[0], frame.shape[1], 4))
+            frame = np.zeros((frame.shape[0], frame.shape[1], 4),
+                             dtype=np.uint8)
             frame[:min(frame.shape[0], zoomed.shape[0]),
                   :min(frame.shape[1], zoomed.shape[1]),
                   :zoomed.shape[2]] = \
@@ -54,6 +58,8 @@ class Zoom:
 
 
 class Move:
+    static = True
+
     def __init__(self, horizontal, vertical, relative=False, periodic=True,
                  *args, **kwargs):
 
@@ -92,6 +98,11 @@ class Translate_to_head:
         self.anchor_point = anchor_point
         self.average_frames = average_frames
 
+        if self.anchor_point == "EYES":
+            self.required_outputs = {"heatmaps": [1, 2]}
+        else:
+            self.required_outputs = {"part_heatmaps": [0, 1]}
+
         self._avg_points = []
         self._avg_points_idx = 0
 
@@ -103,11 +114,11 @@ class Translate_to_head:
 
         if self.anchor_point == "EYES":
             # left and right eye
-            face_mask = np.bitwise_or(heatmap_masks[:,:,1],
-                                      heatmap_masks[:,:,2])
+            face_mask = np.bitwise_or(heatmap_masks[1],
+                                      heatmap_masks[2])
         else:
             # left and right half of the face
-            face_mask = np.bitwise_or(part_masks[:,:,0], part_masks[:,:,1])
+            face_mask = np.bitwise_or(part_masks[0], part_masks[1])
 
         objs = ndimage.find_objects(face_mask)
         min_x, min_y, max_x, max_y = np.inf, np.inf, -np.inf, -np.inf
@@ -145,6 +156,8 @@ class Translate_to_head:
                        order=0)
 
 class Affine:
+    static = True
+
     def __init__(self, matrix=[[1,0],[0,1]], offset=[0,0], relative=False,
                  *args, **kwargs):
 
@@ -168,9 +181,8 @@ class Affine:
 
         if frame.shape[2] == 3:
             # Add alpha channel
-            frame = np.append(frame,
-                    np.ones((frame.shape[0], frame.shape[1], 1)) * 255.0,
-                    axis=2)
+            frame = np.dstack((frame,
+                np.full(frame.shape[:2], 255, dtype=np.uint8)))
 
         frame = ndimage.affine_transform(frame,
                        matrix=matrix,
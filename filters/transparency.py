@@ -3,6 +3,8 @@ import numpy as np
 
 
 class ChangeAlpha:
+    static = True
+
     def __init__(self,
                  alpha_change=0,
                  alpha_min=0,
@@ -14,19 +16,19 @@ class ChangeAlpha:
 
     def apply(self, *args, **kwargs):
         frame = kwargs['frame']
-        if frame.shape[2] == 4:
-            frame[:,:,3] = np.clip(frame[:,:,3] + self.alpha_change,
-                                   self.alpha_min, self.alpha_max)
-        elif frame.shape[2] == 3:
-            frame = np.clip(np.append(
-                frame,
-                np.ones((frame.shape[0], frame.shape[1], 1)) * 255 + \
-                        self.alpha_change, axis=2),
-                self.alpha_min, self.alpha_max)
+        if frame.shape[2] == 3:
+            # Add alpha channel
+            frame = np.dstack((frame,
+                np.full(frame.shape[:2], 255, dtype=np.uint8)))
+        frame[:,:,3] = np.clip(frame[:,:,3].astype(np.int16) +
+                               self.alpha_change,
+                               self.alpha_min, self.alpha_max)
         return frame
 
 
 class ChromaKey:
+    static = True
+
     def __init__(self, r=0.0, g=255.0, b=0.0, fuzz=10.0, *args, **kwargs):
         self.rgb_from = np.clip(
                 np.array([r - fuzz, g - fuzz, b - fuzz]), 0, 255)
@@ -37,8 +39,8 @@ class ChromaKey:
         frame = kwargs['frame']
         if frame.shape[2] == 3:
             # Add alpha channel
-            frame = np.append(frame,
-                    np.ones((frame.shape[0], frame.shape[1], 1)) * 255.0, axis=2)
+            frame = np.dstack((frame,
+                np.full(frame.shape[:2], 255, dtype=np.uint8)))
 
         frame[np.min(
             (frame[:,:,:3] >= self.rgb_from) & (frame[:,:,:3] <= self.rgb_to),
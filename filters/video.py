@@ -4,14 +4,30 @@ import os
 import stat
 import glob
 import time
+import threading
 import numpy as np
+from filters import cache
+from filters.images import copy_to_frame
 
 
-def reload_video(video_path, width, height,
+def video_cache_key(video_path, width, height,
         target_fps, interpolation_method):
+    return cache.cache_key(video_path, width=width, height=height,
+                           target_fps=target_fps,
+                           interpolation_method=interpolation_method)
+
+
+def reload_video(video_path, width, height,
+        target_fps, interpolation_method, cache_dir=None):
+
+    key = video_cache_key(video_path, width, height,
+                          target_fps, interpolation_method)
+    cached = cache.load_frames(cache_dir, key)
+    if cached is not None:
+        return cached
 
     results = list(lazy_load_video(video_path, width, height,
-        target_fps, interpolation_method))
+        target_fps, interpolation_method, cache_dir))
 
     if not results:
         return None
@@ -19,9 +35,16 @@ def reload_video(video_path, width, height,
     return results
 
 def lazy_load_video(video_path, width, height,
-        target_fps, interpolation_method):
-    # Do nothing, if the video is unchanged
-    video_stat = os.stat(video_path)
+        target_fps, interpolation_method, cache_dir=None):
+    """
+        Decode and resize the frames of a video. When cache_dir is set,
+        the frames are also written to the cache and the cache entry is
+        committed when the whole video was decoded.
+    """
+    writer = None
+    if cache_dir is not None:
+        writer = cache.FrameWriter(cache_dir, video_cache_key(video_path,
+            width, height, target_fps, interpolation_method))
 
     print("Loading video: " + video_path)
 
@@ -51,14 +74,122 @@ def lazy_load_video(video_path, width, height,
 
         # BGR to RGB
         image[:,:,0], image[:,:,2] = image[:,:,2], image[:,:,0].copy()
+        if writer is not None:
+            writer.write(image)
         yield image
 
+    if writer is not None:
+        writer.close()
     print("Finished loading video:", video_path)
 
 
+class VideoStream:
+    """
+        Decode a video on a background thread into a ring buffer with a
+        fixed number of frames, so the memory usage does not depend on the
+        length of the video. Frames that are not needed for the target fps
+        are skipped without decoding them and the video is looped by seeking
+        back to the start.
+    """
+
+    def __init__(self, video_path, width, height, target_fps,
+                 interpolation_method, buffer_frames=16):
+        self.video_path = video_path
+        self.width = width
+        self.height = height
+        self.target_fps = target_fps
+
+        self.interpolation_method = cv2.INTER_LINEAR
+        if interpolation_method == "NEAREST":
+            self.interpolation_method = cv2.INTER_NEAREST
+
+        # The frame at read_idx is the current frame, the following
+        # num_frames - 1 slots contain the decoded frames after it.
+        self.ring = np.zeros((max(2, buffer_frames), height, width, 3),
+                             dtype=np.uint8)
+        self.read_idx = 0
+        self.num_frames = 0
+        self.condition = threading.Condition()
+        self.stopped = False
+
+        self.thread = threading.Thread(target=self.decode, daemon=True)
+        self.thread.start()
+
+    def decode(self):
+        cap = cv2.VideoCapture(self.video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        target_fps = self.target_fps
+        if target_fps <= 0 or target_fps > fps:
+            target_fps = fps
+        every_nth_frame = max(1, int(round(fps / target_fps))) \
+            if target_fps > 0 else 1
+
+        frame_no = 0
+        while not self.stopped:
+            # Skip frames without decoding them
+            for i in range(every_nth_frame - 1):
+                cap.grab()
+            success, frame = cap.read()
+            if not success:
+                if frame_no == 0:
+                    print("Error loading video "
+                          "(format not supported by OpenCV?):",
+                          self.video_path)
+                    break
+                # Loop the video
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                frame_no = 0
+                continue
+            frame_no += 1
+
+            with self.condition:
+                while self.num_frames == len(self.ring) and \
+                        not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    break
+                write_idx = (self.read_idx + self.num_frames) % len(self.ring)
+
+            # The slot is free, so it can be written without the lock
+            image = cv2.resize(frame, (self.width, self.height),
+                               interpolation=self.interpolation_method)
+            cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=self.ring[write_idx])
+
+            with self.condition:
+                self.num_frames += 1
+                self.condition.notify_all()
+        cap.release()
+
+    def current_frame(self):
+        """
+            Return the current frame or None, when no frame was decoded
+            yet. The frame is valid until the next call of next_frame().
+        """
+        with self.condition:
+            if self.num_frames == 0:
+                return None
+            return self.ring[self.read_idx]
+
+    def next_frame(self):
+        """
+            Advance to the next frame, if it is decoded already.
+        """
+        with self.condition:
+            if self.num_frames > 1:
+                self.read_idx = (self.read_idx + 1) % len(self.ring)
+                self.num_frames -= 1
+                self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+
 class Video:
     def __init__(self, video_path, target_fps=10, interpolation_method="LINEAR",
-                 lazy=True, *args, **kwargs):
+                 lazy=True, streaming=False, buffer_frames=16,
+                 *args, **kwargs):
         config = kwargs['config']
         self.width = config.get("width")
         self.height = config.get("height")
@@ -69,18 +200,45 @@ class Video:
         self.interpolation_method = interpolation_method
         self.mtime = 0
         self.images = []
+        self.cache_dir = cache.get_cache_dir(config)
 
         self.lazy = lazy
+        self.streaming = streaming
+        self.buffer_frames = buffer_frames
+        self.stream = None
         self.reload_video()
 
+    def __del__(self):
+        if self.stream is not None:
+            self.stream.stop()
+
     def reload_video(self):
         video_stat = os.stat(self.video_path)
         if video_stat.st_mtime == self.mtime:
             return
-        if self.lazy:
+        if self.streaming:
+            if self.stream is not None:
+                self.stream.stop()
+            self.stream = VideoStream(self.video_path,
+                    self.width, self.height, self.fps,
+                    self.interpolation_method, self.buffer_frames)
+            self.last_frame_time = time.time()
+            self.mtime = video_stat.st_mtime
+            return
+
+        cached = cache.load_frames(self.cache_dir, video_cache_key(
+            self.video_path, self.width, self.height, self.fps,
+            self.interpolation_method))
+        if self.lazy and cached is not None:
+            # Play the memory mapped frames from the cache
+            self.generator = iter(())
+            self.images = cached
+            self.idx = 0
+            self.last_frame_time = time.time()
+        elif self.lazy:
             self.generator = lazy_load_video(self.video_path,
                     self.width, self.height, self.fps,
-                    self.interpolation_method)
+                    self.interpolation_method, self.cache_dir)
             # Read the first frame, to be able to set the mtime
             try:
                 self.images = [next(self.generator)]
@@ -93,19 +251,33 @@ class Video:
         else:
             images = reload_video(self.video_path,
                     self.width, self.height, self.fps,
-                    self.interpolation_method)
+                    self.interpolation_method, self.cache_dir)
 
-            if images:
+            if images is not None and len(images):
                 self.images = images
                 self.idx = 0
                 self.last_frame_time = time.time()
         self.mtime = video_stat.st_mtime
 
+    def apply_stream(self, frame):
+        image = self.stream.current_frame()
+        if image is None:
+            return np.zeros((self.height, self.width, 3), dtype=np.uint8)
+
+        frame = copy_to_frame(image, frame)
+        if time.time() - self.last_frame_time > 1.0 / self.fps:
+            self.stream.next_frame()
+            self.last_frame_time = time.time()
+        return frame
+
     def apply(self, *args, **kwargs):
         self.reload_video()
 
-        if not self.images:
-            return np.zeros((self.height, self.width, 3))
+        if self.streaming:
+            return self.apply_stream(kwargs['frame'])
+
+        if not len(self.images):
+            return np.zeros((self.height, self.width, 3), dtype=np.uint8)
 
         if self.lazy:
             # If the generator is not empty, grab the next frame
@@ -115,7 +287,7 @@ class Video:
             except StopIteration:
                 pass
 
-        frame = self.images[self.idx].copy()
+        frame = copy_to_frame(self.images[self.idx], kwargs['frame'])
         if time.time() - self.last_frame_time > 1.0 / self.fps:
             self.idx = (self.idx + 1) % len(self.images)
             self.last_frame_time = time.time()
@@ -0,0 +1,171 @@
+import functools
+
+import cv2
+import numpy as np
+
+
+@functools.lru_cache(maxsize=4)
+def pixel_grid(height, width):
+    grid_x, grid_y = np.meshgrid(np.arange(width, dtype=np.float32),
+                                 np.arange(height, dtype=np.float32))
+    return grid_x, grid_y
+
+
+def to_small_gray(frame, scale):
+    height, width = frame.shape[:2]
+    small = cv2.resize(frame[:,:,:3].astype(np.uint8),
+                       (max(1, int(width * scale)), max(1, int(height * scale))),
+                       interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+
+
+def warp_mask(mask, mask_frame, frame, scale=0.25):
+    """
+        Warp a mask, that was computed for mask_frame, towards frame using
+        the optical flow between both frames. The flow is estimated at a
+        reduced resolution given by scale.
+    """
+    height, width = mask.shape[:2]
+    mask_gray = to_small_gray(mask_frame, scale)
+    frame_gray = to_small_gray(frame, scale)
+
+    # For every pixel of the new frame, where was it in the mask frame?
+    flow = cv2.calcOpticalFlowFarneback(frame_gray, mask_gray, None,
+                                        0.5, 3, 15, 3, 5, 1.2, 0)
+    flow = cv2.resize(flow, (width, height),
+                      interpolation=cv2.INTER_LINEAR)
+    flow *= (width / frame_gray.shape[1], height / frame_gray.shape[0])
+
+    grid_x, grid_y = pixel_grid(height, width)
+    return cv2.remap(mask, grid_x + flow[:,:,0], grid_y + flow[:,:,1],
+                     cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+@functools.lru_cache(maxsize=16)
+def box_kernel(size):
+    return np.ones((size, size), np.uint8)
+
+
+def scale_kernel_size(size, scale):
+    """
+        Scale a kernel size to a mask with a different resolution,
+        without disabling kernels, that are set.
+    """
+    if not size:
+        return 0
+    return max(1, int(round(size * scale)))
+
+
+def process_mask(mask, dilate=0, erode=0, blur=0):
+    """
+        Dilate, erode and blur a uint8 mask.
+    """
+    if dilate:
+        mask = cv2.dilate(mask, box_kernel(dilate), iterations=1)
+    if erode:
+        mask = cv2.erode(mask, box_kernel(erode), iterations=1)
+    if blur:
+        mask = cv2.blur(mask, (blur, blur))
+    return mask
+
+
+def guided_upsample(mask, guide, radius=4, eps=0.01):
+    """
+        Upscale a uint8 mask to the size of a uint8 gray guide image with a
+        fast guided filter, so the edges of the mask follow the edges in the
+        guide image. The linear coefficients are computed with the
+        resolution of the mask and only applied with the full resolution.
+    """
+    height, width = mask.shape[:2]
+    guide_height, guide_width = guide.shape[:2]
+    small_guide = cv2.resize(guide, (width, height),
+                             interpolation=cv2.INTER_AREA)
+    small_guide = small_guide.astype(np.float32) / 255.0
+    mask = mask.astype(np.float32) / 255.0
+
+    ksize = (2 * radius + 1, 2 * radius + 1)
+    mean_guide = cv2.blur(small_guide, ksize)
+    mean_mask = cv2.blur(mask, ksize)
+    covariance = cv2.blur(small_guide * mask, ksize) - mean_guide * mean_mask
+    variance = cv2.blur(small_guide * small_guide, ksize) - \
+        mean_guide * mean_guide
+
+    a = covariance / (variance + eps)
+    b = (mean_mask - a * mean_guide) * 255.0
+
+    a = cv2.resize(cv2.blur(a, ksize), (guide_width, guide_height),
+                   interpolation=cv2.INTER_LINEAR)
+    b = cv2.resize(cv2.blur(b, ksize), (guide_width, guide_height),
+                   interpolation=cv2.INTER_LINEAR)
+
+    # Compute a * guide + b directly as saturated uint8 values
+    result = cv2.multiply(a, guide, dtype=cv2.CV_32F)
+    return cv2.add(result, b, dtype=cv2.CV_8U)
+
+
+class MaskSmoother:
+    """
+        Temporal smoothing of masks to reduce flickering.
+
+        - "average": The mean of the last size masks. The masks are kept
+          in a ring buffer with a running sum, so an update costs the same
+          for any size.
+        - "exponential": An exponential moving average, where each new mask
+          has the weight alpha.
+
+        When motion_threshold is set and gray images of the frames are
+        given, the smoothing is reduced where the image changes by more
+        than motion_threshold gray levels, so moving persons do not leave
+        afterimages.
+    """
+
+    def __init__(self):
+        self.settings = None
+        self.previous_gray = None
+
+    def reset(self, shape, settings):
+        self.settings = settings
+        self.ring = np.zeros((settings[1],) + shape, dtype=np.float32)
+        self.sum = np.zeros(shape, dtype=np.float32)
+        self.idx = 0
+        self.count = 0
+        self.average = None
+        self.previous_gray = None
+
+    def update(self, mask, mode="average", size=3, alpha=0.5, gray=None,
+               motion_threshold=0):
+        """
+            Add a float32 mask with values between 0 and 1 and return the
+            smoothed mask.
+        """
+        size = max(1, size)
+        settings = (mode, size, mask.shape)
+        if settings != self.settings:
+            self.reset(mask.shape, settings)
+
+        if mode == "exponential":
+            if self.average is None:
+                self.average = mask.copy()
+            else:
+                cv2.accumulateWeighted(mask, self.average, alpha)
+            smoothed = self.average
+        else:
+            # Replace the oldest mask in the running sum
+            if self.count == size:
+                self.sum -= self.ring[self.idx]
+            else:
+                self.count += 1
+            self.ring[self.idx] = mask
+            self.sum += mask
+            self.idx = (self.idx + 1) % size
+            smoothed = self.sum / self.count
+
+        if motion_threshold and gray is not None:
+            if self.previous_gray is not None and \
+                    self.previous_gray.shape == gray.shape:
+                motion = cv2.absdiff(gray, self.previous_gray)
+                motion = np.minimum(motion.astype(np.float32) /
+                                    motion_threshold, 1.0)
+                smoothed = smoothed + motion * (mask - smoothed)
+            self.previous_gray = gray
+        return smoothed
@@ -0,0 +1,132 @@
+"""
+    Loading of the bodypix models.
+
+    The tfjs models are converted to a TensorFlow graph once, optimized
+    with grappler (constant folding, arithmetic simplification and
+    pruning) and stored as frozen graph next to the tfjs files, so later
+    starts only need to parse the frozen graph.
+"""
+
+import os
+
+import tensorflow as tf
+import tfjs_graph_converter.api as tfjs_api
+import tfjs_graph_converter.util as tfjs_util
+from tensorflow.core.protobuf import config_pb2
+from tensorflow.core.protobuf import meta_graph_pb2
+from tensorflow.python.grappler import tf_optimizer
+
+
+FROZEN_GRAPH_FILENAME = "frozen_graph.pb"
+
+OPTIMIZERS = ["pruning", "constfold", "arithmetic", "dependency"]
+
+
+def get_model_path(model_type, multiplier, output_stride):
+    if model_type == "mobilenet":
+        return ('bodypix_mobilenet_float_{multiplier:03d}' +
+            '_model-stride{stride}').format(
+            multiplier=int(100 * multiplier), stride=output_stride)
+    elif model_type == "resnet50":
+        return 'bodypix_resnet50_float_model-stride{stride}'.format(
+            stride=output_stride)
+    return None
+
+
+def optimize_graph(graph, output_tensor_names):
+    """
+        Run the grappler optimizations on the graph and return the
+        optimized GraphDef.
+    """
+    with graph.as_default():
+        meta_graph = tf.compat.v1.train.export_meta_graph(graph=graph)
+
+    # Grappler keeps the nodes in the "train_op" collection
+    fetch_collection = meta_graph_pb2.CollectionDef()
+    fetch_collection.node_list.value.extend(
+        [name.split(":")[0] for name in output_tensor_names])
+    meta_graph.collection_def["train_op"].CopyFrom(fetch_collection)
+
+    config = config_pb2.ConfigProto()
+    rewrite_options = config.graph_options.rewrite_options
+    rewrite_options.optimizers.extend(OPTIMIZERS)
+    rewrite_options.min_graph_nodes = -1
+    return tf_optimizer.OptimizeGraph(config, meta_graph)
+
+
+def graph_from_graph_def(graph_def):
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name="")
+    return graph
+
+
+def with_batch_input(graph, input_tensor_name):
+    """
+        Return a copy of the graph, whose input accepts a batch of images,
+        and its input tensor. The graph is returned unchanged, when the
+        batch size of the input is not fixed.
+    """
+    input_tensor = graph.get_tensor_by_name(input_tensor_name)
+    shape = input_tensor.shape.as_list()
+    if shape[0] is None:
+        return graph, input_tensor
+
+    batch_graph = tf.Graph()
+    with batch_graph.as_default():
+        batch_input = tf.compat.v1.placeholder(
+            input_tensor.dtype, [None] + shape[1:], name="batch_input")
+        tf.import_graph_def(graph.as_graph_def(),
+                            input_map={input_tensor_name: batch_input},
+                            name="")
+    return batch_graph, batch_input
+
+
+def is_cache_valid(model_path, cache_filename):
+    """
+        The frozen graph is valid, when it is newer than all tfjs files
+        (model.json and the weight shards).
+    """
+    try:
+        cache_mtime = os.stat(cache_filename).st_mtime
+        return all(os.stat(os.path.join(model_path, filename)).st_mtime <=
+                   cache_mtime for filename in os.listdir(model_path)
+                   if filename.endswith((".json", ".bin")))
+    except OSError:
+        return False
+
+
+def load_graph(model_path, use_cache=True):
+    """
+        Load the tfjs model in model_path as tf.Graph. With use_cache,
+        the optimized frozen graph is loaded, if it is up to date, and
+        written otherwise.
+    """
+    cache_filename = os.path.join(model_path, FROZEN_GRAPH_FILENAME)
+    if use_cache and is_cache_valid(model_path, cache_filename):
+        graph_def = tf.compat.v1.GraphDef()
+        with open(cache_filename, "rb") as graphfile:
+            graph_def.ParseFromString(graphfile.read())
+        return graph_from_graph_def(graph_def)
+
+    graph = tfjs_api.load_graph_model(model_path)
+    if not use_cache:
+        return graph
+
+    print("Optimizing the model. This is only done once.")
+    try:
+        graph_def = optimize_graph(graph,
+                                   tfjs_util.get_output_tensors(graph))
+        graph = graph_from_graph_def(graph_def)
+    except Exception as e:
+        print("Cannot optimize the model:", e)
+        graph_def = graph.as_graph_def()
+
+    tmp_filename = cache_filename + ".tmp"
+    try:
+        with open(tmp_filename, "wb") as graphfile:
+            graphfile.write(graph_def.SerializeToString())
+        os.replace(tmp_filename, cache_filename)
+    except OSError as e:
+        print("Cannot write the frozen model:", e)
+    return graph
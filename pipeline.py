@@ -0,0 +1,231 @@
+"""
+    Helpers to run the processing steps of the virtual webcam
+    as a pipeline of threads connected by bounded queues.
+"""
+
+import queue
+import threading
+import time
+
+
+# Returned by the source of a pipeline to stop the pipeline after all
+# previous items were processed by all stages
+END = object()
+
+
+class LatestQueue(queue.Queue):
+    """
+        A bounded queue, that drops its oldest items when it is full,
+        so the consumer always gets the freshest item.
+    """
+
+    def __init__(self, maxsize=1):
+        super().__init__(maxsize=maxsize)
+        self.dropped = 0
+
+    def put_latest(self, item):
+        while True:
+            try:
+                self.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+class Stage(threading.Thread):
+    """
+        A pipeline stage, that calls its function with the items from the
+        input queue and puts the results into the output queue.
+        A stage without input queue is a source and calls its function
+        without arguments. When the source returns END, each stage passes
+        it on and stops, and the last stage stops the pipeline.
+    """
+
+    def __init__(self, name, function, input_queue, output_queue, stopped,
+                 drop_stale=True):
+        super().__init__(name=name, daemon=True)
+        self.function = function
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.stopped = stopped
+        self.drop_stale = drop_stale
+        self.error = None
+
+    def get(self):
+        while not self.stopped.is_set():
+            try:
+                return self.input_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def put(self, item):
+        if self.drop_stale:
+            self.output_queue.put_latest(item)
+            return
+        while not self.stopped.is_set():
+            try:
+                self.output_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                if self.input_queue is None:
+                    result = self.function()
+                else:
+                    item = self.get()
+                    if item is None:
+                        break
+                    result = END if item is END else self.function(*item)
+                if result is END:
+                    if self.output_queue is None:
+                        self.stopped.set()
+                    else:
+                        self.put(END)
+                    break
+                if self.output_queue is not None and result is not None:
+                    self.put(result)
+        except BaseException as e:
+            # Stop the whole pipeline and let run() re-raise the error
+            self.error = e
+            self.stopped.set()
+
+
+class Pipeline:
+    """
+        A chain of stages. Each stage runs on its own thread and passes
+        its result (a tuple of arguments) to the next stage.
+    """
+
+    def __init__(self, queue_size=1):
+        self.queue_size = queue_size
+        self.stopped = threading.Event()
+        self.stages = []
+
+    def add_stage(self, name, function, drop_stale=True):
+        """
+            Append a stage. With drop_stale the stage replaces results,
+            that were not consumed by the next stage yet, otherwise it
+            waits until the next stage is ready.
+        """
+        input_queue = None
+        if self.stages:
+            input_queue = LatestQueue(self.queue_size)
+            self.stages[-1].output_queue = input_queue
+        self.stages.append(Stage(name, function, input_queue, None,
+                                 self.stopped, drop_stale))
+
+    def stop(self):
+        self.stopped.set()
+
+    def queue_stats(self):
+        """
+            Return the number of waiting and dropped items of the input
+            queue of each stage.
+        """
+        values = {}
+        for stage in self.stages:
+            if stage.input_queue is not None:
+                values["queued:" + stage.name] = stage.input_queue.qsize()
+                values["dropped:" + stage.name] = stage.input_queue.dropped
+        return values
+
+    def run(self):
+        """
+            Run all stages until one of them fails, stop() is called or
+            the source returned END.
+        """
+        for stage in self.stages:
+            stage.start()
+        try:
+            while not self.stopped.wait(timeout=0.5):
+                pass
+        finally:
+            self.stop()
+            for stage in self.stages:
+                stage.join()
+        for stage in self.stages:
+            if stage.error is not None:
+                raise stage.error
+
+
+class Worker(threading.Thread):
+    """
+        A background thread, that calls its function with the latest
+        submitted arguments at most `rate` times per second (0 means
+        as fast as possible) and keeps the latest result.
+    """
+
+    def __init__(self, name, function, rate=0):
+        super().__init__(name=name, daemon=True)
+        self.function = function
+        self.rate = rate
+        self.condition = threading.Condition()
+        self.args = None
+        self.latest = None
+        self.error = None
+        self.stopped = False
+        # Duration of the last call of function
+        self.duration = 0.0
+
+    def submit(self, *args):
+        """
+            Replace the pending arguments. Arguments, that were not
+            processed yet, are dropped.
+        """
+        with self.condition:
+            self.args = args
+            self.condition.notify_all()
+
+    def result(self, wait=True):
+        """
+            Return the latest result. With wait, block until the first
+            result is available. Errors of the worker are re-raised here.
+        """
+        with self.condition:
+            while wait and self.latest is None and self.error is None:
+                self.condition.wait()
+            if self.error is not None:
+                raise self.error
+            return self.latest
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def run(self):
+        try:
+            while True:
+                with self.condition:
+                    while self.args is None and not self.stopped:
+                        self.condition.wait()
+                    if self.stopped:
+                        return
+                    args, self.args = self.args, None
+
+                started = time.time()
+                result = self.function(*args)
+                self.duration = time.time() - started
+                with self.condition:
+                    self.latest = result
+                    self.condition.notify_all()
+
+                if self.rate > 0:
+                    # Wait for the next run, unless the worker is stopped
+                    with self.condition:
+                        self.condition.wait_for(
+                            lambda: self.stopped,
+                            max(0.0, 1.0 / self.rate -
+                                (time.time() - started)))
+        except BaseException as e:
+            with self.condition:
+                self.error = e
+                self.condition.notify_all()
@@ -0,0 +1,157 @@
+"""
+    Adaptive quality control to hold a target frame rate.
+
+    The controller compares the processing time of the frames with the
+    frame time of target_fps and steps through a list of quality levels.
+    Each level is a dict of config values, which are applied on top of the
+    config and of all levels before it. The controller steps down, when the
+    frames take longer than the frame time, and up again, when the frames
+    take less than (1 - headroom) of the frame time. When a step up is
+    followed by a step down right away, the controller waits twice as long
+    before the next step up. When a step up holds, it waits interval again.
+
+    The processing time must include the segmentation, also when it runs
+    in the background with segmentation_fps, otherwise a level with
+    segmentation_fps always looks fast enough for a step up.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+
+# Marker for values, that were not set in the config
+MISSING = object()
+
+
+def default_levels(config, target_fps):
+    """
+        Return quality levels, that reduce the internal resolution, the
+        resolution of the mask processing and finally the segmentation rate.
+    """
+    internal_resolution = config.get("internal_resolution", 0.5)
+    mask_resolution = config.get("mask_resolution", 1.0)
+    segmentation_fps = config.get("segmentation_fps", 0) or target_fps
+    return [
+        {"internal_resolution": round(max(0.1, internal_resolution * 0.75), 2)},
+        {"mask_resolution": min(mask_resolution, 0.5)},
+        {"internal_resolution": round(max(0.1, internal_resolution * 0.5), 2)},
+        {"segmentation_fps": min(segmentation_fps, target_fps / 2.0)},
+    ]
+
+
+class QualityController:
+    def __init__(self, target_fps, levels, interval=2.0, headroom=0.25):
+        self.frame_time = 1.0 / target_fps
+        self.levels = levels
+        self.interval = interval
+        self.headroom = headroom
+        self.level = 0
+        self.lock = threading.Lock()
+        self.times = []
+        self.original = {}
+        self.last_decision = time.time()
+        self.last_change = self.last_decision
+        self.last_step_up = None
+        self.hold = interval
+
+    def add(self, processing_time):
+        """
+            Add the processing time of a frame, i.e., the time without
+            waiting for the webcam.
+        """
+        with self.lock:
+            self.times.append(processing_time)
+
+    def overrides(self):
+        """
+            Return the config values of the current level.
+        """
+        values = {}
+        for level in self.levels[:self.level]:
+            values.update(level)
+        return values
+
+    def update(self):
+        """
+            Decide about the quality level at most every interval seconds
+            and return True, when the level changed.
+        """
+        now = time.time()
+        if now - self.last_decision < self.interval:
+            return False
+        with self.lock:
+            times, self.times = self.times, []
+        if not times:
+            return False
+        self.last_decision = now
+        mean_time = float(np.mean(times))
+
+        if self.last_step_up is not None and \
+                now - self.last_step_up >= 2 * self.interval:
+            # The last step up held, so try the next one sooner again
+            self.hold = self.interval
+            self.last_step_up = None
+
+        if mean_time > self.frame_time and self.level < len(self.levels):
+            # The last step up was too much, so wait longer for the next one
+            if self.last_step_up is not None and \
+                    now - self.last_step_up < 2 * self.interval:
+                self.hold = min(2 * self.hold, 64 * self.interval)
+            self.last_step_up = None
+            self.change_level(self.level + 1, mean_time, now)
+            return True
+
+        if mean_time < (1.0 - self.headroom) * self.frame_time and \
+                self.level > 0 and now - self.last_change >= self.hold:
+            self.last_step_up = now
+            self.change_level(self.level - 1, mean_time, now)
+            return True
+        return False
+
+    def change_level(self, level, mean_time, now):
+        old_level, self.level = self.level, level
+        self.last_change = now
+        print("Quality level {old} -> {new}: {time:.1f} ms per frame "
+              "for a frame time of {frame_time:.1f} ms, using {overrides}"
+              .format(old=old_level, new=level, time=1000.0 * mean_time,
+                      frame_time=1000.0 * self.frame_time,
+                      overrides=self.overrides()))
+
+    def apply(self, config):
+        """
+            Set the config values of the current level in config and restore
+            the original values of the keys, that are no longer overridden.
+            Return the keys, that were changed.
+        """
+        changed = set(self.original)
+        for key, value in self.original.items():
+            if value is MISSING:
+                config.pop(key, None)
+            else:
+                config[key] = value
+        self.original = {}
+
+        for key, value in self.overrides().items():
+            self.original[key] = config.get(key, MISSING)
+            config[key] = value
+            changed.add(key)
+        return changed
+
+    def stats(self):
+        return {"quality_level": self.level}
+
+
+def create_controller(config):
+    """
+        Create the quality controller for the target_fps in the config or
+        return None, when no target is set.
+    """
+    target_fps = config.get("target_fps", 0)
+    if not target_fps:
+        return None
+    levels = config.get("adaptive_quality_levels") or \
+        default_levels(config, target_fps)
+    return QualityController(target_fps, levels,
+                             config.get("adaptive_quality_interval", 2.0))
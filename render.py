@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+    Render a video file or a directory of images with the layers of a
+    config into a video file, without a webcam and without a virtual
+    video device, e.g., to pre-render backgrounds or to check a config.
+
+    The frames are decoded, segmented, composed and encoded on their own
+    threads. The model is run on batches of --batch-size frames, which
+    needs fewer runs of the model than segmenting each frame. All frames
+    are processed, none is dropped.
+"""
+
+import argparse
+import os
+import time
+
+import cv2
+import yaml
+
+from pipeline import END
+from pipeline import Pipeline
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+class ImageDirectoryCapture:
+    """
+        Replacement for cv2.VideoCapture, that reads the images of a
+        directory in the order of their names.
+    """
+
+    def __init__(self, path):
+        self.filenames = [os.path.join(path, filename)
+                          for filename in sorted(os.listdir(path))
+                          if filename.lower().endswith(IMAGE_EXTENSIONS)]
+        if not self.filenames:
+            raise ValueError("No images found in " + path)
+        self.idx = 0
+        first_frame = cv2.imread(self.filenames[0])
+        self.height, self.width = first_frame.shape[:2]
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self.filenames)
+        return 0
+
+    def read(self):
+        if self.idx >= len(self.filenames):
+            return False, None
+        frame = cv2.imread(self.filenames[self.idx])
+        self.idx += 1
+        if frame is not None and frame.shape[:2] != (self.height, self.width):
+            frame = cv2.resize(frame, (self.width, self.height))
+        return frame is not None, frame
+
+    def release(self):
+        pass
+
+
+def open_input(path):
+    if os.path.isdir(path):
+        return ImageDirectoryCapture(path)
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError("Cannot open " + path)
+    return cap
+
+
+def render(virtual_webcam, cap, batch_size):
+    """
+        Run the pipeline until all frames of cap were written
+        and return the number of frames.
+    """
+    num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    written = [0]
+
+    def decode_stage():
+        frames = []
+        while len(frames) < batch_size:
+            success, frame = cap.read()
+            if not success:
+                break
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if not frames:
+            return END
+        return (frames,)
+
+    def segmentation_stage(frames):
+        return (frames, virtual_webcam.segment_batch(frames))
+
+    def compositing_stage(frames, masks):
+        return ([[virtual_webcam.compose_frame(frame, mask, part_masks,
+                                               heatmap_masks, output)
+                  for output in virtual_webcam.outputs]
+                 for frame, (mask, part_masks, heatmap_masks)
+                 in zip(frames, masks)],)
+
+    def encoding_stage(output_frames):
+        for frames in output_frames:
+            for output, frame in zip(virtual_webcam.outputs, frames):
+                virtual_webcam.write_frame(frame, output)
+            written[0] += 1
+        if num_frames > 0:
+            print("{written}/{total} frames".format(
+                written=written[0], total=num_frames), end="\r", flush=True)
+
+    # Two batches per queue keep all stages busy
+    pipeline = Pipeline(queue_size=2)
+    pipeline.add_stage("decode", decode_stage, drop_stale=False)
+    pipeline.add_stage("segmentation", segmentation_stage, drop_stale=False)
+    pipeline.add_stage("compositing", compositing_stage, drop_stale=False)
+    pipeline.add_stage("encoding", encoding_stage, drop_stale=False)
+    pipeline.run()
+    return written[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="video file or directory of images")
+    parser.add_argument("output", help="output video file, e.g., out.mp4")
+    parser.add_argument("--config", default="config.yaml",
+                        help="config file with the layers to render")
+    parser.add_argument("--output-name",
+                        help="render this output of the \"outputs\" "
+                             "in the config")
+    parser.add_argument("--batch-size", type=int, default=8,
+                        help="number of frames per run of the model")
+    parser.add_argument("--fps", type=float,
+                        help="frame rate of the output (default: the frame "
+                             "rate of the input video or 30)")
+    parser.add_argument("--fourcc", default="mp4v",
+                        help="codec of the output video")
+    options = parser.parse_args()
+
+    import sinks
+    import virtual_webcam
+
+    with open(options.config, "r") as configfile:
+        config = yaml.load(configfile, Loader=yaml.SafeLoader) or {}
+    if config.get("outputs"):
+        output_configs = dict(virtual_webcam.get_output_configs(config))
+        name = options.output_name or next(iter(output_configs))
+        if name not in output_configs:
+            parser.error("The config has no output " + name)
+        config = output_configs[name]
+    # A region of interest needs the result of the previous frame
+    config["roi"] = False
+    config["batch_size"] = options.batch_size
+
+    cap = open_input(options.input)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = options.fps or cap.get(cv2.CAP_PROP_FPS) or 30
+
+    sink = sinks.VideoFileSink(options.output, width, height, fps,
+                               options.fourcc)
+    virtual_webcam.config = config
+    virtual_webcam.setup(cap, sink)
+    if not virtual_webcam.backend.batched and options.batch_size > 1:
+        print("The model does not accept batches, "
+              "the frames are segmented one by one.")
+
+    start = time.perf_counter()
+    num_frames = render(virtual_webcam, cap, options.batch_size)
+    elapsed = time.perf_counter() - start
+    print()
+    cap.release()
+    sink.release()
+    print("Rendered {frames} frames in {elapsed:.1f} s ({fps:.1f} fps)."
+          .format(frames=num_frames, elapsed=elapsed,
+                  fps=num_frames / max(elapsed, 1e-6)))
+
+
+if __name__ == "__main__":
+    main()
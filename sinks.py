@@ -0,0 +1,149 @@
+"""
+    Sinks for the output frames. Like pyfakewebcam.FakeWebcam, every sink
+    has a schedule_frame() method, that takes an RGB frame.
+
+    - virtual_video_device: A v4l2loopback device, which gets the frames
+      in YUYV or I420 format (virtual_video_format).
+    - output_file: A video file written with OpenCV, e.g. "out.mp4".
+    - output_pipe: Raw RGB24 frames written to a file or named pipe, e.g.
+      for "ffmpeg -f rawvideo -pix_fmt rgb24 -s WIDTHxHEIGHT -i PIPE ...".
+"""
+
+import fcntl
+import os
+import stat
+
+import cv2
+import numpy as np
+import pyfakewebcam.v4l2 as v4l2
+
+
+# The config values of an output, that are used by the sinks
+SINK_KEYS = ["virtual_video_device", "virtual_video_format",
+             "output_file", "output_pipe", "output_fps"]
+
+
+class V4L2Sink:
+    """
+        Write frames to a v4l2loopback device in the native YUYV or I420
+        format. The frames are converted by OpenCV directly into a
+        preallocated buffer, which is written to the device without further
+        copies. The device may also be a regular file or a named pipe,
+        which receive the raw frames, e.g., for tests.
+    """
+
+    def __init__(self, device, width, height, pixel_format="YUYV"):
+        if pixel_format == "YUYV":
+            if not hasattr(cv2, "COLOR_RGB2YUV_YUYV"):
+                raise ValueError("This OpenCV version cannot convert to YUYV, "
+                                 "use the I420 format.")
+            self.conversion = cv2.COLOR_RGB2YUV_YUYV
+            self.buffer = np.empty((height, width, 2), dtype=np.uint8)
+            fourcc = v4l2.V4L2_PIX_FMT_YUYV
+            bytes_per_line = width * 2
+        elif pixel_format == "I420":
+            if width % 2 or height % 2:
+                raise ValueError("I420 needs an even width and height.")
+            self.conversion = cv2.COLOR_RGB2YUV_I420
+            self.buffer = np.empty((height * 3 // 2, width), dtype=np.uint8)
+            fourcc = v4l2.V4L2_PIX_FMT_YUV420
+            bytes_per_line = width
+        else:
+            raise ValueError("Unknown pixel format: " + str(pixel_format))
+
+        if not os.path.exists(device):
+            raise FileNotFoundError(
+                "The device {device} does not exist. Make sure the "
+                "v4l2loopback kernel module is loaded.".format(device=device))
+        self.width = width
+        self.height = height
+        self.fd = os.open(device, os.O_WRONLY)
+
+        if stat.S_ISCHR(os.fstat(self.fd).st_mode):
+            settings = v4l2.v4l2_format()
+            settings.type = v4l2.V4L2_BUF_TYPE_VIDEO_OUTPUT
+            settings.fmt.pix.pixelformat = fourcc
+            settings.fmt.pix.width = width
+            settings.fmt.pix.height = height
+            settings.fmt.pix.field = v4l2.V4L2_FIELD_NONE
+            settings.fmt.pix.bytesperline = bytes_per_line
+            settings.fmt.pix.sizeimage = self.buffer.nbytes
+            # OpenCV converts to limited range BT.601
+            settings.fmt.pix.colorspace = v4l2.V4L2_COLORSPACE_SMPTE170M
+            fcntl.ioctl(self.fd, v4l2.VIDIOC_S_FMT, settings)
+
+    def schedule_frame(self, frame):
+        if frame.shape[:2] != (self.height, self.width):
+            raise ValueError("The frame size {frame_size} does not match the "
+                             "device size {size}.".format(
+                                 frame_size=frame.shape[:2],
+                                 size=(self.height, self.width)))
+        cv2.cvtColor(frame, self.conversion, dst=self.buffer)
+        data = memoryview(self.buffer).cast("B")
+        while data:
+            data = data[os.write(self.fd, data):]
+
+    def __del__(self):
+        if hasattr(self, "fd"):
+            os.close(self.fd)
+
+
+class VideoFileSink:
+    def __init__(self, filename, width, height, fps=30, fourcc="mp4v"):
+        self.writer = cv2.VideoWriter(filename,
+                                      cv2.VideoWriter_fourcc(*fourcc),
+                                      fps, (width, height))
+        if not self.writer.isOpened():
+            raise OSError("Cannot open the video file " + filename)
+
+    def schedule_frame(self, frame):
+        self.writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+
+    def release(self):
+        """
+            Finish the video file.
+        """
+        self.writer.release()
+
+    def __del__(self):
+        if hasattr(self, "writer"):
+            self.release()
+
+
+class PipeSink:
+    def __init__(self, filename):
+        # Opening a named pipe blocks until a reader opens it
+        self.file = open(filename, "wb")
+
+    def schedule_frame(self, frame):
+        try:
+            self.file.write(np.ascontiguousarray(frame))
+            self.file.flush()
+        except BrokenPipeError:
+            pass
+
+    def __del__(self):
+        if hasattr(self, "file"):
+            self.file.close()
+
+
+def sink_spec(output_config):
+    """
+        Return the settings of the sink of an output config, so unchanged
+        sinks can be reused after a config change.
+    """
+    return tuple(output_config.get(key) for key in SINK_KEYS)
+
+
+def create_sink(output_config, width, height):
+    """
+        Create the sink for an output config: an output_file or an
+        output_pipe, if one is given, or the virtual_video_device.
+    """
+    if output_config.get("output_file"):
+        return VideoFileSink(output_config.get("output_file"), width, height,
+                             output_config.get("output_fps", 30))
+    if output_config.get("output_pipe"):
+        return PipeSink(output_config.get("output_pipe"))
+    return V4L2Sink(output_config.get("virtual_video_device"), width, height,
+                    output_config.get("virtual_video_format", "YUYV"))
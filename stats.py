@@ -0,0 +1,162 @@
+"""
+    Timing statistics of the processing steps.
+
+    The durations of the last frames are kept per step and summarized as
+    percentiles. The summary can be printed periodically or queried as
+    JSON from a local HTTP server or Unix socket.
+"""
+
+import collections
+import contextlib
+import http.server
+import json
+import os
+import socketserver
+import stat
+import threading
+import time
+
+import numpy as np
+
+
+class Stats:
+    def __init__(self, window=300):
+        self.window = window
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.counters = {}
+        self.sources = []
+        self.last_log_time = time.time()
+
+    def record(self, name, duration):
+        with self.lock:
+            if name not in self.durations:
+                self.durations[name] = collections.deque(maxlen=self.window)
+            self.durations[name].append(duration)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def count(self, name, increment=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + increment
+
+    def add_source(self, source):
+        """
+            Add a function, that returns a dict of additional values
+            (e.g., queue sizes), which are added to the summary.
+        """
+        self.sources.append(source)
+
+    def reset(self):
+        with self.lock:
+            self.durations.clear()
+            self.counters.clear()
+
+    def summary(self):
+        """
+            Return the percentiles of the durations in milliseconds, the
+            counters and the values of the sources.
+        """
+        with self.lock:
+            durations = [(name, list(values))
+                         for name, values in self.durations.items()]
+            counters = dict(self.counters)
+
+        timings = {}
+        for name, values in durations:
+            if not values:
+                continue
+            values_ms = 1000.0 * np.array(values)
+            timings[name] = {
+                "mean": float(values_ms.mean()),
+                "p50": float(np.percentile(values_ms, 50)),
+                "p90": float(np.percentile(values_ms, 90)),
+                "p99": float(np.percentile(values_ms, 99)),
+                "max": float(values_ms.max()),
+            }
+
+        values = {}
+        for source in self.sources:
+            values.update(source())
+        return {"timings": timings, "counters": counters, "values": values}
+
+    def format_line(self):
+        summary = self.summary()
+        parts = []
+        frame = summary["timings"].get("frame")
+        if frame and frame["mean"] > 0:
+            parts.append("{fps:.1f} fps".format(fps=1000.0 / frame["mean"]))
+        parts += ["{name} {p50:.1f}/{p99:.1f}ms".format(name=name, **timing)
+                  for name, timing in summary["timings"].items()]
+        parts += ["{name}={value}".format(name=name, value=value)
+                  for name, value in list(summary["counters"].items()) +
+                  list(summary["values"].items())]
+        return ", ".join(parts)
+
+    def log(self, interval):
+        """
+            Print a summary line, when the last one is older than
+            interval seconds.
+        """
+        if not interval or time.time() - self.last_log_time < interval:
+            return
+        self.last_log_time = time.time()
+        print("Stats:", self.format_line())
+
+
+class StatsRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(self.server.stats.summary(), indent=2).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixStatsRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        body = json.dumps(self.server.stats.summary(), indent=2) + "\n"
+        self.wfile.write(body.encode())
+
+
+def serve(stats, address):
+    """
+        Serve the summary as JSON on a background thread. address is either
+        "HOST:PORT" for HTTP or "unix:PATH" for a Unix socket, which returns
+        the summary to every client that connects.
+    """
+    if address.startswith("unix:"):
+        path = address[len("unix:"):]
+        # Only replace the socket of an earlier run, never other files
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise FileExistsError(
+                    "{path} exists and is not a socket".format(path=path))
+            os.remove(path)
+        server = socketserver.ThreadingUnixStreamServer(
+            path, UnixStatsRequestHandler)
+    else:
+        host, _, port = address.rpartition(":")
+        server = http.server.ThreadingHTTPServer((host or "127.0.0.1",
+                                                  int(port)),
+                                                 StatsRequestHandler)
+    server.daemon_threads = True
+    server.stats = stats
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print("Serving stats on", address)
+    return server
+
+
+# The statistics of the running program
+stats = Stats()
@@ -1,24 +1,45 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
+import functools
 import sys
 import time
 import os
 import yaml
 
 import tensorflow as tf
-import tfjs_graph_converter.api as tfjs_api
-import tfjs_graph_converter.util as tfjs_util
 
 import numpy as np
 import cv2
-from pyfakewebcam import FakeWebcam
 
-from bodypix_functions import calc_padding
-from bodypix_functions import scale_and_crop_to_input_tensor_shape
+from bodypix_functions import InputPreprocessor
+from bodypix_functions import crop_to_frame_tensor
+from bodypix_functions import scale_and_threshold_to_input_shape
+from bodypix_functions import scale_to_input_shape
+from bodypix_functions import sigmoid
+from bodypix_functions import tensor_scale
 from bodypix_functions import to_input_resolution_height_and_width
-from bodypix_functions import to_mask_tensor
 
+import backends
+from capture import Capture
 import filters
+import models
+from compositing import BufferPool
+from compositing import alpha_range
+from compositing import blend
+from compositing import to_uint8
+from compositing import with_alpha
+from file_watcher import FileWatcher
+from mask_functions import MaskSmoother
+from mask_functions import guided_upsample
+from mask_functions import process_mask
+from mask_functions import scale_kernel_size
+from mask_functions import warp_mask
+from pipeline import Pipeline
+from pipeline import Worker
+import quality
+import sinks
+import stats
 
 
 def load_config(config_mtime, oldconfig={}):
@@ -43,25 +64,141 @@ def load_config(config_mtime, oldconfig={}):
     return config, config_mtime
 
 
-def reload_layers(config):
+def reload_layers(config, previous_layers=()):
+    """
+        Create the layers of the config. The filters of previous_layers
+        are reused for filters, whose config did not change.
+    """
+    previous_filters = filters.filters_by_spec(
+        [image_filter for layer_type, layer_filters in previous_layers
+         for image_filter in layer_filters])
     layers = []
     for layer_filters in config.get("layers", []):
         assert(type(layer_filters) == dict)
         assert(len(layer_filters) == 1)
         layer_type = list(layer_filters.keys())[0]
         layer_filters = layer_filters[layer_type]
-        layers.append((layer_type, filters.get_filters(config, layer_filters)))
+        layers.append((layer_type, filters.get_filters(config, layer_filters,
+                                                       previous_filters)))
     return layers
 
 
+def same_filters(filters_a, filters_b):
+    return len(filters_a) == len(filters_b) and \
+        all(a is b for a, b in zip(filters_a, filters_b))
+
+
+class Output:
+    """
+        An output with its own layers and sink. All outputs share the
+        capture and the segmentation.
+    """
+
+    def __init__(self, name, output_config, sink):
+        self.name = name
+        self.config = output_config
+        self.sink = sink
+        self.layers = []
+        # Cached output of layers, that do not change between frames
+        self.static_layers = {}
+        # The layers, that were opaque in the last frame
+        self.opaque_layers = {}
+
+    def reload_layers(self, output_config):
+        """
+            Update the layers for a changed config. Only the filters, that
+            changed, are created and the cached static layers, whose filters
+            did not change, are kept.
+        """
+        self.config = output_config
+        self.layers = reload_layers(output_config, self.layers)
+        self.static_layers = {
+            index: cached for index, cached in self.static_layers.items()
+            if index < len(self.layers) and
+            same_filters(cached[0], self.layers[index][1])}
+        self.opaque_layers = {}
+
+    def step_name(self, step):
+        if self.name == "default":
+            return step
+        return self.name + "/" + step
+
+
+def get_output_configs(config):
+    """
+        Return the names and configs of the outputs. Each output in the
+        "outputs" option has its own layers and sink settings, all other
+        values are taken from the config. Without "outputs", there is a
+        single output "default".
+    """
+    if not config.get("outputs"):
+        return [("default", config)]
+    output_configs = []
+    for name, output_config in config["outputs"].items():
+        merged = dict(config)
+        del merged["outputs"]
+        merged.update(output_config or {})
+        output_configs.append((str(name), merged))
+    return output_configs
+
+
+def reload_outputs(config, previous_outputs=()):
+    """
+        Create the outputs of the config. Outputs with the same name and
+        sink settings as one of previous_outputs keep their sink and reuse
+        their unchanged filters.
+    """
+    previous = {output.name: output for output in previous_outputs}
+    new_outputs = []
+    for name, output_config in get_output_configs(config):
+        output = previous.pop(name, None)
+        if output is None or sinks.sink_spec(output.config) != \
+                sinks.sink_spec(output_config):
+            sink = sink_override
+            if sink is None:
+                sink = sinks.create_sink(output_config, width, height)
+            output = Output(name, output_config, sink)
+        output.reload_layers(output_config)
+        new_outputs.append(output)
+    return new_outputs
+
+
 # ### Global variables ###
 
 # The last mask frames are kept to average the actual mask
 # to reduce flickering
-masks = []
+mask_smoother = MaskSmoother()
+
+# Region of interest for the segmentation and the number of frames,
+# that were segmented since the last segmentation of the full frame
+roi = None
+roi_frames = 0
 
 # Load the config
 config, config_mtime = load_config(0)
+config_watcher = FileWatcher("config.yaml")
+
+# Adaptive quality control, when target_fps is set
+quality_controller = None
+
+# Background worker for the segmentation, when segmentation_fps is set
+segmentation_worker = None
+
+# Reusable buffers for the output frames and layer frames
+buffers = BufferPool()
+
+# The outputs with their layers and sinks
+outputs = []
+
+# Thread pool to compute the layers concurrently, when layer_threads is set
+layer_pool = None
+layer_pool_threads = 0
+
+# Replacement for the sinks of all outputs, e.g., for benchmarks
+sink_override = None
+
+# Time of the last output frame
+last_output_time = None
 
 # ### End global variables ####
 
@@ -73,86 +210,184 @@ for device in gpu_devices:
 
 # tf.get_logger().setLevel("DEBUG")
 
-# VideoCapture for the real webcam
-cap = cv2.VideoCapture(config.get("real_video_device"))
-
-# Configure the resolution of the real webcam
-if config.get("width"):
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, config.get("width"))
-if config.get("height"):
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, config.get("height"))
-
-# Attempt to reduce the buffer size
-if not cap.set(cv2.CAP_PROP_BUFFERSIZE, 1):
-    print('Failed to reduce capture buffer size. Latency will be higher!')
-
-# Get the actual resolution (either webcam default or the configured one)
-width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-
-config['width'], config['height'] = width, height
-
-# Initialize a fake video device with the same resolution as the real device
-fakewebcam = FakeWebcam(config.get("virtual_video_device"), width, height)
-
-# Choose the bodypix (mobilenet) model
-# Allowed values:
-# - Stride 8 or 16
-# internal_resolution: 0.25, 0.5, 0.75, 1.0
-
-output_stride = config.get("stride", 16)
-multiplier = config.get("multiplier", 0.5)
-model_type = config.get("model", "mobilenet")
-
-if model_type == "resnet":
-    model_type = "resnet50"
-
-if model_type == "mobilenet":
-    print("Model: mobilenet (multiplier={multiplier}, stride={stride})".format(
-        multiplier=multiplier, stride=output_stride))
-    model_path = ('bodypix_mobilenet_float_{multiplier:03d}' +
-        '_model-stride{stride}').format(
-        multiplier=int(100 * multiplier), stride=output_stride)
-elif model_type == "resnet50":
-    print("Model: resnet50 (stride={stride})".format(
-        stride=output_stride))
-    model_path = 'bodypix_resnet50_float_model-stride{stride}'.format(
-        stride=output_stride)
-else:
-    print('Unknown model type. Use "mobilenet" or "resnet50".')
-    sys.exit(1)
-
-# Load the tensorflow model
-print("Loading model...")
-graph = tfjs_api.load_graph_model(model_path)
-print("done.")
-
-# Setup the tensorflow session
-sess = tf.compat.v1.Session(graph=graph)
-
-input_tensor_names = tfjs_util.get_input_tensors(graph)
-output_tensor_names = tfjs_util.get_output_tensors(graph)
-input_tensor = graph.get_tensor_by_name(input_tensor_names[0])
-
-# Initialize layers
-layers = reload_layers(config)
-
-static_image = None
-for extension in ["jpg", "jpeg", "png"]:
-    if config['real_video_device'].lower().endswith(extension):
-        success, static_image = cap.read()
+def is_image_file(path):
+    return str(path).lower().endswith(("jpg", "jpeg", "png"))
 
-def mainloop():
-    global config, masks, layers, config_mtime
 
-    config, config_mtime_new = load_config(config_mtime, config)
-    if config_mtime != config_mtime_new:
+def open_webcam():
+    """
+        Open the real webcam and configure its resolution.
+    """
+    cap = cv2.VideoCapture(config.get("real_video_device"))
+
+    # Request a pixel format, e.g. MJPG for high resolutions
+    fourcc = config.get("real_video_fourcc")
+    if fourcc:
+        if not cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc)):
+            print("Failed to set the capture format to", fourcc)
+
+    # Configure the resolution of the real webcam
+    if config.get("width"):
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, config.get("width"))
+    if config.get("height"):
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, config.get("height"))
+
+    capture_scale = config.get("capture_scale", 1.0)
+    if fourcc == "MJPG" and capture_scale != 1.0:
+        # Decode the frames with the reduced size ourselves
+        cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+
+    # Attempt to reduce the buffer size
+    buffer_size_set = cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    # A static image is read only once, see setup()
+    if is_image_file(config.get("real_video_device")):
+        return cap
+
+    if config.get("capture_thread", True) or capture_scale != 1.0:
+        capture = Capture(cap, capture_scale)
+        stats.stats.add_source(capture.stats)
+        return capture
+
+    if not buffer_size_set:
+        print('Failed to reduce capture buffer size. Latency will be higher!')
+    return cap
+
+
+def load_model():
+    """
+        Load the bodypix model selected in the config.
+    """
+    global backend, model_type, output_stride
+
+    # Choose the bodypix (mobilenet) model
+    # Allowed values:
+    # - Stride 8 or 16
+    # internal_resolution: 0.25, 0.5, 0.75, 1.0
+
+    output_stride = config.get("stride", 16)
+    multiplier = config.get("multiplier", 0.5)
+    model_type = config.get("model", "mobilenet")
+
+    if model_type == "resnet":
+        model_type = "resnet50"
+
+    if model_type == "mobilenet":
+        print("Model: mobilenet (multiplier={multiplier}, stride={stride})".format(
+            multiplier=multiplier, stride=output_stride))
+    elif model_type == "resnet50":
+        print("Model: resnet50 (stride={stride})".format(
+            stride=output_stride))
+    else:
+        print('Unknown model type. Use "mobilenet" or "resnet50".')
+        sys.exit(1)
+    model_path = models.get_model_path(model_type, multiplier, output_stride)
+
+    get_preprocessor.cache_clear()
+
+    # Load the model with the configured inference backend
+    print("Loading model...")
+    try:
+        backend = backends.load_backend(config, model_path)
+    except (OSError, ValueError, ImportError) as e:
+        print("Cannot load the model:", e)
+        sys.exit(1)
+    print("done.")
+
+
+def setup(capture=None, output=None):
+    """
+        Open the webcam and the virtual webcam, load the model and
+        initialize the layers. capture and output replace the real webcam
+        (anything with the read() and get() methods of cv2.VideoCapture)
+        and the sinks of all outputs (anything with a schedule_frame()
+        method), e.g., for benchmarks.
+    """
+    global cap, width, height, outputs, sink_override, static_image
+    global quality_controller
+
+    cap = capture
+    if cap is None:
+        cap = open_webcam()
+
+    # Get the actual resolution (either webcam default or the configured one)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    config['width'], config['height'] = width, height
+
+    load_model()
+
+    # Initialize the layers and the virtual video devices (or other sinks)
+    # with the same resolution as the real device
+    sink_override = output
+    outputs = reload_outputs(config)
+
+    quality_controller = quality.create_controller(config)
+    stats.stats.add_source(quality_stats)
+
+    static_image = None
+    if capture is None:
+        if is_image_file(config['real_video_device']):
+            success, static_image = cap.read()
+
+
+def reload_config():
+    """
+        Reload the config and the layers, when the config file changed,
+        and apply the config values of the current quality level.
+    """
+    global config, outputs, config_mtime, quality_controller
+
+    config_mtime_new = config_mtime
+    if config_watcher.changed():
+        config, config_mtime_new = load_config(config_mtime, config)
+    reload = config_mtime != config_mtime_new
+    if reload:
         config['width'] = width
         config['height'] = height
-        layers = []  # Allow filters to run their destructors
-        layers = reload_layers(config)
         config_mtime = config_mtime_new
+        quality_controller = quality.create_controller(config)
+
+    if quality_controller is not None and quality_controller.update():
+        changed = quality_controller.apply(config)
+        reload = reload or "layers" in changed or "outputs" in changed
+
+    if reload:
+        outputs = reload_outputs(config, outputs)
+
+
+def add_processing_time(processing_time):
+    """
+        Pass the time, that a frame took without waiting for the webcam,
+        to the quality controller.
+    """
+    if quality_controller is not None:
+        quality_controller.add(processing_time)
+
+
+def async_segmentation_time():
+    """
+        Return the duration of the last background segmentation with
+        segmentation_fps, which is not part of the time of a frame, or 0.
+    """
+    if segmentation_worker is None:
+        return 0.0
+    return segmentation_worker.duration
+
+
+def quality_stats():
+    if quality_controller is None:
+        return {}
+    return quality_controller.stats()
+
 
+def read_frame():
+    """
+        Read the next frame from the webcam and convert it to RGB.
+        Return the frame and the time, when it was captured.
+    """
+    start = time.perf_counter()
     if static_image is not None:
         success, frame = True, static_image
     else:
@@ -160,152 +395,590 @@ def mainloop():
     if not success:
         print("Error getting a webcam image!")
         sys.exit(1)
+    capture_time = getattr(cap, "frame_time", time.perf_counter())
     # BGR to RGB
-    frame = frame[...,::-1]
-    frame = frame.astype(np.float)
+    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    stats.stats.record("capture", time.perf_counter() - start)
+    return frame, capture_time
 
-    input_height, input_width = frame.shape[:2]
-    internal_resolution = config.get("internal_resolution", 0.5)
 
+def record_time(name, start):
+    """
+        Record the time since start for the step name and return the
+        current time as start of the next step.
+    """
+    now = time.perf_counter()
+    stats.stats.record(name, now - start)
+    return now
+
+
+def get_required_outputs():
+    """
+        Return the model outputs besides the segments, that are used by
+        the layers of all outputs or the debug options, with the used
+        channels.
+    """
+    required_outputs = {}
+    for output in outputs:
+        for layer_type, layer_filters in output.layers:
+            filters.get_required_outputs(layer_filters, required_outputs)
+
+        if output.config.get("debug_show_mask") is not None:
+            mask_id = int(output.config.get("debug_show_mask"))
+            if mask_id > -1 and mask_id < 24:
+                filters.add_required_output(required_outputs,
+                                            "part_heatmaps", [mask_id])
+        elif output.config.get("debug_show_heatmap") is not None:
+            heatmap_id = int(output.config.get("debug_show_heatmap"))
+            if heatmap_id > -1 and heatmap_id < 17:
+                filters.add_required_output(required_outputs, "heatmaps",
+                                            [heatmap_id])
+    return required_outputs
+
+
+@functools.lru_cache(maxsize=16)
+def get_preprocessor(input_height, input_width, internal_resolution):
+    """
+        Return the preprocessing for the frame size and internal
+        resolution. The input size and padding only change, when the
+        internal resolution is changed in the config.
+    """
     target_height, target_width = to_input_resolution_height_and_width(
         internal_resolution, output_stride, input_height, input_width)
+    return InputPreprocessor(input_height, input_width,
+                             target_height, target_width, model_type)
+
+
+def get_roi(segment_mask, input_height, input_width, padding):
+    """
+        Return the region (top, bottom, left, right) of the frame around
+        the foreground of a low resolution mask or None, when there is no
+        foreground or the region covers most of the frame.
+    """
+    x, y, w, h = cv2.boundingRect((segment_mask > 0).astype(np.uint8))
+    if w == 0 or h == 0:
+        return None
+
+    tensor_height, tensor_width = segment_mask.shape
+    padT, padB, padL, padR = padding
+    scale_y = tensor_scale(tensor_height, input_height, padT, padB)
+    scale_x = tensor_scale(tensor_width, input_width, padL, padR)
+    margin = config.get("roi_margin", 0.1)
+
+    # Extend the box by one tensor pixel and the margin
+    top = (y - 1) / scale_y - padT - margin * input_height
+    bottom = (y + h) / scale_y - padT + margin * input_height
+    left = (x - 1) / scale_x - padL - margin * input_width
+    right = (x + w) / scale_x - padL + margin * input_width
+
+    # Snap the region to a grid of 1/8 of the frame size,
+    # so the model input size does not change for every frame
+    step_y = input_height / 8
+    step_x = input_width / 8
+    top = max(0, int(np.floor(top / step_y) * step_y))
+    bottom = min(input_height, int(np.ceil(bottom / step_y) * step_y))
+    left = max(0, int(np.floor(left / step_x) * step_x))
+    right = min(input_width, int(np.ceil(right / step_x) * step_x))
+
+    if (bottom - top) * (right - left) > 0.8 * input_height * input_width:
+        return None
+    return top, bottom, left, right
+
+
+def segment_frame(frame):
+    """
+        Run the model on a frame and return the (smoothed) mask,
+        the part masks and the heatmap masks.
+
+        With the "roi" option, only the region around the person in the
+        last frame is segmented, except for every roi_full_frame_interval
+        frames or when the person was lost.
+    """
+    global roi_frames
+
+    start = time.perf_counter()
+    input_height, input_width = frame.shape[:2]
+    internal_resolution = config.get("internal_resolution", 0.5)
 
-    padT, padB, padL, padR = calc_padding(frame, target_height, target_width)
-    resized_frame = tf.image.resize_with_pad(
-        frame,
-        target_height, target_width,
-        method=tf.image.ResizeMethod.BILINEAR
-    )
+    # Resize with padding and normalize the frame
+    preprocessor = get_preprocessor(input_height, input_width,
+                                    internal_resolution)
 
-    resized_height, resized_width = resized_frame.shape[:2]
+    crop_box = None
+    crop_preprocessor = None
+    if config.get("roi", False) and roi is not None and \
+            roi_frames < config.get("roi_full_frame_interval", 30):
+        crop_box = roi
+        roi_frames += 1
+    else:
+        roi_frames = 0
 
-    # Preprocessing
-    if model_type == "mobilenet":
-        resized_frame = np.divide(resized_frame, 127.5)
-        resized_frame = np.subtract(resized_frame, 1.0)
-    elif model_type == "resnet50":
-        m = np.array([-123.15, -115.90, -103.06])
-        resized_frame = np.add(resized_frame, m)
+    if crop_box is None:
+        sample_image = preprocessor(frame)
     else:
-        assert(False)
-
-    sample_image = resized_frame[tf.newaxis, ...]
-
-    results = sess.run(output_tensor_names,
-                       feed_dict={input_tensor: sample_image})
-
-    for idx, name in enumerate(output_tensor_names):
-        if name == "float_segments:0":
-            segment_logits = results[idx]
-        elif name == "float_part_heatmaps:0":
-            part_heatmaps = results[idx]
-        elif name == "float_heatmaps:0":
-            heatmaps = results[idx]
-
-    scaled_segment_scores = scale_and_crop_to_input_tensor_shape(
-        segment_logits, input_height, input_width,
-        padT, padB, padL, padR, True
-    )
-
-    scaled_part_heatmap_scores = scale_and_crop_to_input_tensor_shape(
-        part_heatmaps, input_height, input_width,
-        padT, padB, padL, padR, True
-    )
-
-    scaled_heatmap_scores = scale_and_crop_to_input_tensor_shape(
-        heatmaps, input_height, input_width,
-        padT, padB, padL, padR, True
-    )
-
-    mask = to_mask_tensor(scaled_segment_scores,
-                          config.get("segmentation_threshold", 0.75))
-    mask = np.reshape(mask, mask.shape[:2])
-
-    part_masks = to_mask_tensor(scaled_part_heatmap_scores, 0.999)
-    part_masks = np.array(part_masks)
-    heatmap_masks = to_mask_tensor(scaled_heatmap_scores, 0.99)
-    heatmap_masks = np.array(heatmap_masks)
-
-    # Average over the last N masks to reduce flickering
-    # (at the cost of seeing afterimages)
-    num_average_masks = max(1, config.get("average_masks", 3))
-    masks.insert(0, mask)
-    masks = masks[:num_average_masks]
-
-    mask = np.mean(masks, axis=0)
-    mask = (mask * 255).astype(np.uint8)
-
-    dilate_value = config.get("dilate", 0)
-    erode_value = config.get("erode", 0)
-    blur_value = config.get("blur", 0)
-
-    if dilate_value:
-        mask = cv2.dilate(mask,
-                          np.ones((dilate_value, dilate_value), np.uint8),
-                          iterations=1)
-    if erode_value:
-        mask = cv2.erode(mask,
-                         np.ones((erode_value, erode_value),
-                                 np.uint8), iterations=1)
-    if blur_value:
-        mask = cv2.blur(mask, (blur_value, blur_value))
-
-    frame = np.append(frame, np.expand_dims(mask, axis=2), axis=2)
-
-    input_frame = frame.copy()
-    frame = np.zeros(input_frame.shape)
-    for layer_type, layer_filters in layers:
-        # Initialize the layer frame
-        layer_frame = np.zeros(frame.shape)  # transparent black
-        if layer_type == "foreground":
-            layer_frame = input_frame.copy()
-        elif layer_type == "input":
-            layer_frame = input_frame.copy()
-            # make the frame opaque
-            layer_frame[:,:,3] = 255 * np.ones(input_frame.shape[:2])
-        elif layer_type == "previous":
-            layer_frame = frame.copy()
-            # make the frame opaque
-            layer_frame[:,:,3] = 255 * np.ones(input_frame.shape[:2])
-        elif layer_type == "empty":
-            pass
-
-        layer_frame = filters.apply_filters(layer_frame, mask, part_masks,
-                                            heatmap_masks, layer_filters)
-        if layer_frame.shape[2] == 4:
-            transparency = layer_frame[:,:,3] / 255.0
-            transparency = np.expand_dims(transparency, axis=2)
-            frame[:,:,:3] = frame[:,:,:3] * \
-                (1.0 - transparency) + layer_frame[:,:,:3] * transparency
+        top, bottom, left, right = crop_box
+        crop_preprocessor = get_preprocessor(bottom - top, right - left,
+                                             internal_resolution)
+        sample_image = crop_preprocessor(frame[top:bottom, left:right])
+    start = record_time("preprocess", start)
+
+    # Only fetch the outputs, that are actually used
+    required_outputs = get_required_outputs()
+    results = backend.run(sample_image, get_fetch_names(required_outputs))
+    record_time("inference", start)
+
+    return segment_results(frame, results, preprocessor, required_outputs,
+                           crop_box, crop_preprocessor)
+
+
+def segment_batch(frames):
+    """
+        Segment several frames with a single run of the model and return
+        the masks of each frame like segment_frame(). The roi option is
+        not used, as the region of a frame depends on the previous frame.
+    """
+    start = time.perf_counter()
+    input_height, input_width = frames[0].shape[:2]
+    preprocessor = get_preprocessor(input_height, input_width,
+                                    config.get("internal_resolution", 0.5))
+    # The preprocessor reuses its tensor, so copy each frame into the batch
+    sample_images = np.empty((len(frames),) + preprocessor.tensor.shape[1:],
+                             dtype=np.float32)
+    for sample_image, frame in zip(sample_images, frames):
+        sample_image[...] = preprocessor(frame)[0]
+    start = record_time("preprocess", start)
+
+    required_outputs = get_required_outputs()
+    batch_results = backends.run_batch(backend, sample_images,
+                                       get_fetch_names(required_outputs))
+    record_time("inference", start)
+
+    return [segment_results(frame, results, preprocessor, required_outputs)
+            for frame, results in zip(frames, batch_results)]
+
+
+def get_fetch_names(required_outputs):
+    return ["segments"] + [name for name in required_outputs
+                           if name in backend.output_names]
+
+
+def segment_results(frame, results, preprocessor, required_outputs,
+                    crop_box=None, crop_preprocessor=None):
+    """
+        Compute the (smoothed) mask, the part masks and the heatmap masks
+        of a frame from the model outputs. crop_box is the region of the
+        frame, that was segmented with crop_preprocessor, or None for
+        the full frame.
+    """
+    global roi
+
+    start = time.perf_counter()
+    input_height, input_width = frame.shape[:2]
+    padT, padB, padL, padR = preprocessor.padding
+
+    if crop_box is not None:
+        # Process the results like the results for the full frame
+        frame_tensor_height = \
+            (preprocessor.tensor.shape[1] - 1) // output_stride + 1
+        frame_tensor_width = \
+            (preprocessor.tensor.shape[2] - 1) // output_stride + 1
+        for name in results:
+            results[name] = crop_to_frame_tensor(
+                results[name], crop_box, crop_preprocessor.padding,
+                frame_tensor_height, frame_tensor_width,
+                input_height, input_width, preprocessor.padding)
+
+    segment_logits = results["segments"]
+    part_heatmaps = results.get("part_heatmaps")
+    heatmaps = results.get("heatmaps")
+
+    # Smooth the probabilities over time with the model resolution,
+    # to reduce flickering (at the cost of seeing afterimages).
+    # They are thresholded after upscaling, so the edges stay sharp.
+    threshold = config.get("segmentation_threshold", 0.75)
+    segment_mask = sigmoid(segment_logits[0,:,:,0].astype(np.float32))
+
+    frame_gray = None
+    gray = None
+    motion_threshold = config.get("mask_motion_threshold", 0)
+    if motion_threshold:
+        tensor_height, tensor_width = segment_mask.shape
+        frame_gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        gray = cv2.copyMakeBorder(frame_gray,
+                                  padT, padB, padL, padR,
+                                  cv2.BORDER_REPLICATE)
+        gray = cv2.resize(gray, (tensor_width, tensor_height),
+                          interpolation=cv2.INTER_AREA)
+
+    segment_mask = mask_smoother.update(
+        segment_mask,
+        mode=config.get("mask_smoothing", "average"),
+        size=config.get("average_masks", 3),
+        alpha=config.get("mask_smoothing_alpha", 0.5),
+        gray=gray,
+        motion_threshold=motion_threshold)
+
+    if config.get("roi", False):
+        roi = get_roi(segment_mask > threshold, input_height, input_width,
+                      preprocessor.padding)
+
+    # Optionally process the mask with a reduced resolution
+    # and upscale it to the frame afterwards
+    mask_resolution = min(1.0, config.get("mask_resolution", 1.0))
+    mask_height = max(1, int(round(input_height * mask_resolution)))
+    mask_width = max(1, int(round(input_width * mask_resolution)))
+    scale = mask_width / input_width
+    mask = scale_to_input_shape(segment_mask, mask_height, mask_width,
+                                padT * scale, padB * scale,
+                                padL * scale, padR * scale)
+    mask = cv2.compare(mask, threshold, cv2.CMP_GT)
+
+    part_masks = None
+    if part_heatmaps is not None:
+        part_masks = scale_and_threshold_to_input_shape(
+            part_heatmaps, input_height, input_width,
+            padT, padB, padL, padR, 0.999,
+            required_outputs["part_heatmaps"]
+        )
+
+    heatmap_masks = None
+    if heatmaps is not None:
+        heatmap_masks = scale_and_threshold_to_input_shape(
+            heatmaps, input_height, input_width,
+            padT, padB, padL, padR, 0.99,
+            required_outputs["heatmaps"]
+        )
+
+    start = record_time("upsample", start)
+
+    mask = process_mask(
+        mask,
+        dilate=scale_kernel_size(config.get("dilate", 0), scale),
+        erode=scale_kernel_size(config.get("erode", 0), scale),
+        blur=scale_kernel_size(config.get("blur", 0), scale))
+
+    if mask.shape[:2] != (input_height, input_width):
+        if config.get("mask_upsampling", "guided") == "guided":
+            if frame_gray is None:
+                frame_gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+            mask = guided_upsample(mask, frame_gray,
+                                   config.get("mask_guided_radius", 4))
         else:
-            frame[:,:,:3] = layer_frame[:,:,:3].copy()
+            mask = cv2.resize(mask, (input_width, input_height),
+                              interpolation=cv2.INTER_LINEAR)
+    record_time("mask", start)
+
+    return mask, part_masks, heatmap_masks
+
+
+def segment_latest(frame):
+    """
+        Pass the frame to the background segmentation and return the
+        latest available segmentation result, optionally warped towards
+        the frame.
+    """
+    global segmentation_worker
+
+    if segmentation_worker is None:
+        segmentation_worker = Worker(
+            "segmentation", lambda frame: (frame,) + segment_frame(frame))
+        segmentation_worker.start()
+    segmentation_worker.rate = config.get("segmentation_fps", 0)
+    segmentation_worker.submit(frame)
+
+    mask_frame, mask, part_masks, heatmap_masks = \
+        segmentation_worker.result()
+    if config.get("mask_warp", False) and mask_frame is not frame:
+        mask = warp_mask(mask, mask_frame, frame)
+    return mask, part_masks, heatmap_masks
+
+
+def stop_segmentation_worker():
+    """
+        Stop the background segmentation and wait until a running
+        segmentation finished, as segment_frame() must not run twice at
+        the same time.
+    """
+    global segmentation_worker
+
+    if segmentation_worker is not None:
+        segmentation_worker.stop()
+        segmentation_worker.join()
+        segmentation_worker = None
+
+
+def segment(frame):
+    if config.get("segmentation_fps"):
+        return segment_latest(frame)
+    stop_segmentation_worker()
+    return segment_frame(frame)
+
+
+def get_static_layer(output, index, layer_shape, layer_filters):
+    """
+        Return the cached output of a static layer and recompute it, when
+        the source of one of its filters changed.
+    """
+    cached_filters, layer_frame = output.static_layers.get(index, ([], None))
+    if layer_frame is None or layer_frame.shape[:2] != layer_shape[:2] or \
+            not same_filters(cached_filters, layer_filters) or \
+            filters.filters_changed(layer_filters):
+        layer_frame = np.zeros(layer_shape, dtype=np.uint8)
+        layer_frame = filters.apply_filters(
+            layer_frame, None, None, None, layer_filters, stats=stats.stats,
+            stats_name=layer_step_name(output, index) + "/")
+        layer_frame = to_uint8(layer_frame)
+        output.static_layers[index] = (list(layer_filters), layer_frame)
+    return layer_frame
+
+
+def layer_step_name(output, index):
+    return output.step_name("layer{index}:{layer_type}".format(
+        index=index, layer_type=output.layers[index][0]))
+
+
+def render_layer(output, index, input_frame, frame,
+                 mask, part_masks, heatmap_masks):
+    """
+        Compute the frame of a layer. Return the layer frame and the buffer,
+        that must be released after blending it (None for cached layers).
+    """
+    layer_type, layer_filters = output.layers[index]
+    layer_shape = input_frame.shape[:2] + (4,)
+    if layer_type == "empty" and filters.is_static(layer_filters):
+        return get_static_layer(output, index, layer_shape,
+                                layer_filters), None
+
+    # Initialize the layer frame
+    layer_buffer = buffers.acquire(layer_shape)
+    if layer_type == "foreground":
+        layer_frame = with_alpha(input_frame, mask, out=layer_buffer)
+    elif layer_type == "input":
+        layer_frame = with_alpha(input_frame, out=layer_buffer)
+    elif layer_type == "previous":
+        layer_frame = with_alpha(frame, out=layer_buffer)
+    else:
+        # "empty": transparent black
+        layer_frame = layer_buffer
+        layer_frame.fill(0)
+
+    layer_frame = filters.apply_filters(layer_frame, mask, part_masks,
+                                        heatmap_masks, layer_filters,
+                                        buffers, stats.stats,
+                                        layer_step_name(output, index) + "/")
+    return layer_frame, layer_buffer
+
+
+def get_layer_pool():
+    """
+        Return the thread pool for the layers or None, when the layers are
+        computed one after another. The filters spend their time in OpenCV,
+        NumPy and SciPy, which release the GIL, so threads share the frame
+        buffers and the filters without copying them to other processes.
+    """
+    global layer_pool, layer_pool_threads
+
+    threads = config.get("layer_threads", 0)
+    if threads != layer_pool_threads:
+        if layer_pool is not None:
+            layer_pool.shutdown(wait=False)
+        layer_pool = None
+        if threads > 1:
+            layer_pool = concurrent.futures.ThreadPoolExecutor(
+                threads, thread_name_prefix="layer")
+        layer_pool_threads = threads
+    return layer_pool
+
+
+def render_layers(output, indices, input_frame, frame,
+                  mask, part_masks, heatmap_masks):
+    """
+        Compute the layers with the given indices and yield the index, the
+        layer frame, the buffer and the start time of each layer in order.
+        The caller blends each layer into frame before taking the next one.
 
-    # Remove alpha channel
-    frame = frame[:,:,:3]
+        With a layer pool, the layers are computed concurrently, except for
+        "previous" layers, which are only started after all layers below
+        them were blended.
+    """
+    def render(index):
+        start = time.perf_counter()
+        return (index,) + render_layer(output, index, input_frame, frame,
+                                       mask, part_masks, heatmap_masks) + \
+            (start,)
+
+    pool = get_layer_pool()
+    if pool is None:
+        for index in indices:
+            yield render(index)
+        return
+
+    indices = list(indices)
+    futures = []
+    for position in range(len(indices)):
+        while len(futures) < len(indices) and (
+                len(futures) == position or
+                output.layers[indices[len(futures)]][0] != "previous"):
+            futures.append(pool.submit(render, indices[len(futures)]))
+        yield futures[position].result()
+
+
+def blend_layer(output, index, frame, layer_frame, layer_buffer, start):
+    output.opaque_layers[index] = blend(frame, layer_frame, buffers)
+    buffers.release(layer_buffer)
+    record_time(layer_step_name(output, index), start)
+
+
+def compose_frame(frame, mask, part_masks, heatmap_masks, output):
+    """
+        Apply the layers of the output to the frame and return the
+        RGB output frame.
 
-    if config.get("debug_show_mask") is not None:
-        mask_id = int(config.get("debug_show_mask", None))
+        The layers below the topmost layer, that was opaque in the last
+        frame, are hidden. They are neither computed nor blended, as long
+        as this layer stays opaque.
+    """
+    input_frame = frame
+    frame = buffers.acquire(input_frame.shape)
+    frame.fill(0)
+
+    first = 0
+    for index, (layer_type, layer_filters) in enumerate(output.layers):
+        # "previous" layers depend on the layers below
+        if output.opaque_layers.get(index) and layer_type != "previous":
+            first = index
+
+    for index, layer_frame, layer_buffer, start in render_layers(
+            output, range(first, len(output.layers)), input_frame, frame,
+            mask, part_masks, heatmap_masks):
+        if index == first and first > 0 and \
+                alpha_range(to_uint8(layer_frame))[0] < 255:
+            # The layer is no longer opaque, so compose the layers below
+            for lower_index, lower_frame, lower_buffer, lower_start in \
+                    render_layers(output, range(first), input_frame, frame,
+                                  mask, part_masks, heatmap_masks):
+                blend_layer(output, lower_index, frame, lower_frame,
+                            lower_buffer, lower_start)
+
+        blend_layer(output, index, frame, layer_frame, layer_buffer, start)
+
+    # The output config contains the values of the config,
+    # that the output does not override
+    if output.config.get("debug_show_mask") is not None:
+        mask_id = int(output.config.get("debug_show_mask", None))
         if mask_id >-1 and mask_id < 24:
-            mask = part_masks[:,:,mask_id] * 255.0
+            mask = part_masks[mask_id] * 255
         frame[:,:,0] = mask
         frame[:,:,1] = mask
         frame[:,:,2] = mask
-    elif config.get("debug_show_heatmap") is not None:
-        heatmap_id = int(config.get("debug_show_heatmap", None))
+    elif output.config.get("debug_show_heatmap") is not None:
+        heatmap_id = int(output.config.get("debug_show_heatmap", None))
         if heatmap_id >-1 and heatmap_id < 17:
-            mask = heatmap_masks[:,:,heatmap_id] * 255.0
+            mask = heatmap_masks[heatmap_id] * 255
         frame[:,:,0] = mask
         frame[:,:,1] = mask
         frame[:,:,2] = mask
 
-    frame = frame.astype(np.uint8)
-    fakewebcam.schedule_frame(frame)
+    return frame
+
+
+def write_frame(frame, output):
+    start = time.perf_counter()
+    output.sink.schedule_frame(frame)
+    buffers.release(frame)
+    record_time(output.step_name("output"), start)
+
+
+def finish_frame(capture_time):
+    """
+        Record the time between two frames and the latency from the capture
+        to the output, after all outputs were written.
+    """
+    global last_output_time
+
+    now = time.perf_counter()
+    if last_output_time is not None:
+        stats.stats.record("frame", now - last_output_time)
+    last_output_time = now
+    stats.stats.record("latency", now - capture_time)
+    stats.stats.log(config.get("stats_log_interval", 0))
+
+
+def mainloop():
+    reload_config()
+    frame, capture_time = read_frame()
+    start = time.perf_counter()
+    mask, part_masks, heatmap_masks = segment(frame)
+    for output in outputs:
+        write_frame(compose_frame(frame, mask, part_masks, heatmap_masks,
+                                  output), output)
+    finish_frame(capture_time)
+    # Include the background segmentation, so the quality controller sees
+    # the time, that the frame would take with synchronous segmentation
+    add_processing_time(time.perf_counter() - start +
+                        async_segmentation_time())
+
+
+def run_pipelined():
+    """
+        Run capture, segmentation, compositing and output on their own
+        threads. Frames, that are not picked up by the next stage in time,
+        are dropped, so the output always shows the freshest capture.
+    """
+
+    # The last durations of the stages, the slowest one limits the frame rate
+    stage_times = {}
+
+    def capture_stage():
+        return read_frame()
+
+    def segmentation_stage(frame, capture_time):
+        start = time.perf_counter()
+        result = (frame, capture_time) + segment(frame)
+        stage_times["segmentation"] = time.perf_counter() - start + \
+            async_segmentation_time()
+        return result
+
+    def compositing_stage(frame, capture_time, mask, part_masks,
+                          heatmap_masks):
+        reload_config()
+        start = time.perf_counter()
+        output_frames = [(output, compose_frame(frame, mask, part_masks,
+                                                heatmap_masks, output))
+                         for output in outputs]
+        stage_times["compositing"] = time.perf_counter() - start
+        add_processing_time(max(stage_times.values()))
+        return (output_frames, capture_time)
+
+    def output_stage(output_frames, capture_time):
+        for output, frame in output_frames:
+            write_frame(frame, output)
+        finish_frame(capture_time)
+
+    pipeline = Pipeline()
+    # A static image never gets stale, so do not spin on it
+    pipeline.add_stage("capture", capture_stage,
+                       drop_stale=static_image is None)
+    pipeline.add_stage("segmentation", segmentation_stage)
+    pipeline.add_stage("compositing", compositing_stage)
+    pipeline.add_stage("output", output_stage)
+    stats.stats.add_source(pipeline.queue_stats)
+    pipeline.run()
 
 
 if __name__ == "__main__":
-    while True:
+    setup()
+    if config.get("stats_server"):
+        stats.serve(stats.stats, config.get("stats_server"))
+    if config.get("pipeline", False):
         try:
-            mainloop()
+            run_pipelined()
         except KeyboardInterrupt:
             print("stopping.")
-            break
+    else:
+        while True:
+            try:
+                mainloop()
+            except KeyboardInterrupt:
+                print("stopping.")
+                break